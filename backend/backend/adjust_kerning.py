@@ -1,5 +1,13 @@
 import fontforge
+import hashlib
+import json
 import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
+from utils import write_json_atomic
 
 def get_aligned_distance(left_glyph, right_glyph, target_y=None):
     """
@@ -28,9 +36,399 @@ def get_aligned_distance(left_glyph, right_glyph, target_y=None):
 
     return min_distance
 
-def optimize_kerning(font, target_spacing=0, debug=False):
+PROFILE_BANDS = 64
+KERNING_WORKERS = int(os.environ.get("KERNING_WORKERS", "1"))
+# Adjacent-character counts from ~60k words of English news text (the Lee
+# corpus), restricted to the characters we generate glyphs for.
+BIGRAM_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bigram_frequencies.tsv")
+BIGRAM_COVERAGE = 0.999
+
+def get_glyph_points(glyph):
+    """
+    Return every point of the glyph's foreground contours as an (N, 2) array,
+    together with the end index (exclusive) of each contour.
+    """
+    points = []
+    contour_ends = []
+    for contour in glyph.layers[1]:
+        points.extend((point.x, point.y) for point in contour)
+        contour_ends.append(len(points))
+    return np.array(points, dtype=np.float64).reshape(-1, 2), np.array(contour_ends, dtype=np.intp)
+
+def extract_outlines(glyphs):
+    """
+    Pull the contour points of each glyph out of fontforge once.
+    Returns {glyphname: (advance_width, points, contour_ends)}, skipping glyphs without points.
+    """
+    outlines = {}
+    for glyph in glyphs:
+        points, contour_ends = get_glyph_points(glyph)
+        if len(points):
+            outlines[glyph.glyphname] = (glyph.width, points, contour_ends)
+    return outlines
+
+def stack_points(outlines, names):
+    """Concatenate the points of several glyphs; returns (points, start index per glyph)."""
+    counts = np.array([len(outlines[name][1]) for name in names])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.concatenate([outlines[name][1] for name in names]), starts
+
+def compute_point_distances(outlines, left_names=None, right_names=None, pairs=None):
+    """
+    Vectorized equivalent of get_aligned_distance for every ordered pair.
+
+    For each left glyph the points of all other glyphs are shifted by its
+    advance width and queried against a KD-tree of its own points in one call;
+    the per-glyph minimum is then taken with np.minimum.reduceat.
+    If `pairs` is given, only those (left, right) pairs are measured.
+    Returns a list of (left_name, right_name, distance).
+    """
+    names = list(outlines) if right_names is None else list(right_names)
+    if left_names is None:
+        left_names = list(outlines)
+    if not names:
+        return []
+
+    all_points, starts = stack_points(outlines, names)
+
+    distances = []
+    for left_name in left_names:
+        rights, right_points, right_starts = names, all_points, starts
+        if pairs is not None:
+            rights = [name for name in names if (left_name, name) in pairs]
+            if not rights:
+                continue
+            right_points, right_starts = stack_points(outlines, rights)
+
+        width, left_points, _ = outlines[left_name]
+        tree = cKDTree(left_points)
+        shifted = right_points + (width, 0)
+        nearest, _ = tree.query(shifted)
+        pair_min = np.minimum.reduceat(nearest, right_starts)
+        for right_name, distance in zip(rights, pair_min):
+            if right_name != left_name:
+                distances.append((left_name, right_name, float(distance)))
+    return distances
+
+def sample_contour_edges(points, contour_ends, step):
+    """
+    Walk every edge of the closed contours (control polygon for curves) and
+    return points spaced at most `step` apart vertically, so that no band
+    of a profile is skipped by a long edge.
+    """
+    starts = np.concatenate(([0], contour_ends[:-1]))
+    next_index = np.arange(len(points)) + 1
+    next_index[contour_ends - 1] = starts
+    deltas = points[next_index] - points
+
+    samples_per_edge = np.maximum(1, np.ceil(np.abs(deltas[:, 1]) / step)).astype(np.intp)
+    edge_index = np.repeat(np.arange(len(points)), samples_per_edge)
+    first_sample = np.repeat(np.cumsum(samples_per_edge) - samples_per_edge, samples_per_edge)
+    t = (np.arange(len(edge_index)) - first_sample) / samples_per_edge[edge_index]
+    return points[edge_index] + deltas[edge_index] * t[:, None]
+
+def get_glyph_profiles(points, contour_ends, y_min, y_max, bands=PROFILE_BANDS):
+    """
+    Compute the left and right edge profiles of a glyph: the smallest and the
+    largest x of its outline in each of `bands` horizontal bands between
+    y_min and y_max. Empty bands hold +inf (left) and -inf (right).
+    """
+    band_height = (y_max - y_min) / bands
+    samples = sample_contour_edges(points, contour_ends, band_height)
+    band_index = np.clip(((samples[:, 1] - y_min) / band_height).astype(np.intp), 0, bands - 1)
+
+    left_profile = np.full(bands, np.inf)
+    right_profile = np.full(bands, -np.inf)
+    np.minimum.at(left_profile, band_index, samples[:, 0])
+    np.maximum.at(right_profile, band_index, samples[:, 0])
+    return left_profile, right_profile
+
+def extract_profiles(outlines, y_min, y_max, bands=PROFILE_BANDS):
+    """
+    Precompute the edge profiles of every glyph once.
+    Returns {glyphname: (advance_width, left_profile, right_profile)}.
+    """
+    profiles = {}
+    for name, (width, points, contour_ends) in outlines.items():
+        left_profile, right_profile = get_glyph_profiles(points, contour_ends, y_min, y_max, bands)
+        profiles[name] = (width, left_profile, right_profile)
+    return profiles
+
+def compute_profile_distances(profiles, band_height, left_names=None, right_names=None, include_self=False,
+                              pairs=None):
+    """
+    Approximate closest-point distance for every ordered pair from edge profiles.
+
+    The right profile of the left glyph is compared against the left profiles
+    of all right glyphs at once, over every combination of bands, so the cost
+    per pair is bands² regardless of how many points the outlines hold.
+    If `pairs` is given, only those (left, right) pairs are measured.
+    Returns a list of (left_name, right_name, distance).
+    """
+    names = list(profiles) if right_names is None else list(right_names)
+    if left_names is None:
+        left_names = list(profiles)
+    if not names:
+        return []
+
+    left_profiles = np.stack([profiles[name][1] for name in names])
+    bands = left_profiles.shape[1]
+    band_offsets = np.arange(bands) * band_height
+    vertical = (band_offsets[None, :] - band_offsets[:, None]) ** 2
+
+    distances = []
+    for left_name in left_names:
+        rights, candidates = names, left_profiles
+        if pairs is not None:
+            index = [i for i, name in enumerate(names) if (left_name, name) in pairs]
+            if not index:
+                continue
+            rights, candidates = [names[i] for i in index], left_profiles[index]
+
+        width, _, right_profile = profiles[left_name]
+        # gaps[n, i, j]: horizontal gap between band i of the left glyph and band j of glyph n
+        gaps = candidates[:, None, :] + width - right_profile[None, :, None]
+        gaps = np.maximum(gaps, 0)
+        pair_min = np.sqrt((gaps ** 2 + vertical[None]).min(axis=(1, 2)))
+        for right_name, distance in zip(rights, pair_min):
+            if (include_self or right_name != left_name) and np.isfinite(distance):
+                distances.append((left_name, right_name, float(distance)))
+    return distances
+
+def cluster_profiles(named_profiles, tolerance):
+    """
+    Greedily group glyphs whose profiles cover the same bands and agree
+    band-for-band within `tolerance` units of the class's first member.
+    Returns a list of classes (lists of glyph names); the first name of each
+    class is its representative.
+    """
+    classes = []
+    representatives = []
+    for name, profile in named_profiles.items():
+        filled = np.isfinite(profile)
+        for members, representative in zip(classes, representatives):
+            if (np.array_equal(filled, np.isfinite(representative)) and
+                    np.all(np.abs(profile[filled] - representative[filled]) <= tolerance)):
+                members.append(name)
+                break
+        else:
+            classes.append([name])
+            representatives.append(profile)
+    return classes
+
+def get_em_range(font, outlines):
+    """Vertical extent of the em box, widened to any outline that pokes out of it."""
+    y_min, y_max = -font.descent, font.ascent
+    for _, points, _ in outlines.values():
+        y_min = min(y_min, float(points[:, 1].min()))
+        y_max = max(y_max, float(points[:, 1].max()))
+    return y_min, y_max
+
+def get_em_profiles(outlines, em_range, bands=PROFILE_BANDS):
+    """
+    Edge profiles of every glyph over the em range.
+    Returns (profiles, band_height).
+    """
+    y_min, y_max = em_range
+    return extract_profiles(outlines, y_min, y_max, bands), (y_max - y_min) / bands
+
+KERNING_LOOKUP = "pair_kerning_lookup"
+
+FEATURE_HEADER = """languagesystem DFLT dflt;
+languagesystem latn dflt;
+
+"""
+
+FEATURE_FOOTER = f"""
+feature kern {{
+  lookup {KERNING_LOOKUP};
+}} kern;
+"""
+
+def write_pair_feature(fea_path, kerning_values):
+    """
+    Write per-pair kerning values as an OpenType feature file, keeping only
+    pairs whose rounded value exceeds 10 units. Returns the number of pairs.
+    """
+    rules = []
+    for left_name, right_name, kerning_value in kerning_values:
+        if '.notdef' in (left_name, right_name):
+            continue
+        value = round(kerning_value)
+        if abs(value) > 10:
+            rules.append(f"  pos {left_name} {right_name} {value};\n")
+
+    with open(fea_path, "w") as f:
+        f.write(FEATURE_HEADER)
+        f.write(f"lookup {KERNING_LOOKUP} {{\n")
+        f.writelines(rules)
+        f.write(f"}} {KERNING_LOOKUP};\n")
+        f.write(FEATURE_FOOTER)
+    return len(rules)
+
+def write_class_feature(fea_path, first_classes, second_classes, class_values):
+    """
+    Write class-based kerning as an OpenType feature file: one glyph class
+    per kerning class and one pos rule per class pair above 10 units.
+    Class values are keyed by the representatives (first members).
+    Returns the number of class pairs.
+    """
+    rules = []
+    for i, first in enumerate(first_classes):
+        for j, second in enumerate(second_classes):
+            value = round(class_values.get((first[0], second[0]), 0))
+            if abs(value) > 10:
+                rules.append(f"  pos @kern_left_{i} @kern_right_{j} {value};\n")
+
+    with open(fea_path, "w") as f:
+        f.write(FEATURE_HEADER)
+        for i, members in enumerate(first_classes):
+            f.write(f"@kern_left_{i} = [{' '.join(members)}];\n")
+        for j, members in enumerate(second_classes):
+            f.write(f"@kern_right_{j} = [{' '.join(members)}];\n")
+        f.write(f"\nlookup {KERNING_LOOKUP} {{\n")
+        f.writelines(rules)
+        f.write(f"}} {KERNING_LOOKUP};\n")
+        f.write(FEATURE_FOOTER)
+    return len(rules)
+
+def apply_kerning_feature(font, fea_path):
+    """
+    Replace the font's kerning lookup with the one in a saved feature file,
+    merged in a single call. Can be reused on rebuilds without recomputing.
+    """
+    if KERNING_LOOKUP in font.gpos_lookups:
+        font.removeLookup(KERNING_LOOKUP)
+    font.mergeFeature(fea_path)
+
+def load_bigram_frequencies(table_path=BIGRAM_TABLE_PATH):
+    """Read a tab-separated bigram frequency table into {bigram: count}."""
+    frequencies = {}
+    with open(table_path, "r", encoding="utf-8") as f:
+        next(f)  # header
+        for line in f:
+            bigram, count = line.rstrip("\n").split("\t")
+            frequencies[bigram] = int(count)
+    return frequencies
+
+def select_kerning_pairs(glyph_chars, coverage=BIGRAM_COVERAGE, table_path=BIGRAM_TABLE_PATH):
+    """
+    Pick the most frequent glyph pairs that together cover `coverage` of the
+    bigram occurrences between characters the font actually has.
+    glyph_chars maps glyph names to their characters. Returns a set of
+    (left_name, right_name) pairs.
+    """
+    names_by_char = {char: name for name, char in glyph_chars.items()}
+    candidates = []
+    for bigram, count in load_bigram_frequencies(table_path).items():
+        left_char, right_char = bigram
+        if left_char in names_by_char and right_char in names_by_char and left_char != right_char:
+            candidates.append((count, names_by_char[left_char], names_by_char[right_char]))
+    candidates.sort(key=lambda c: -c[0])
+
+    total = sum(count for count, _, _ in candidates)
+    selected = set()
+    covered = 0
+    for count, left_name, right_name in candidates:
+        if total and covered / total >= coverage:
+            break
+        selected.add((left_name, right_name))
+        covered += count
+    return selected
+
+def outline_hash(width, points, contour_ends):
+    """
+    Hash of a glyph's positioned outline, rounded to font units so that
+    re-reading a saved font does not change it.
+    """
+    digest = hashlib.sha1()
+    digest.update(np.int64(round(width)).tobytes())
+    digest.update(np.round(points).astype(np.int64).tobytes())
+    digest.update(contour_ends.astype(np.int64).tobytes())
+    return digest.hexdigest()
+
+def load_kerning_store(store_path):
+    """Load a job's stored kerning distances, or None if there is none."""
+    if not store_path or not os.path.exists(store_path):
+        return None
+    try:
+        with open(store_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_kerning_store(store_path, store):
+    """Write the kerning store atomically so a crash never leaves half a file."""
+    write_json_atomic(store_path, store)
+
+def compute_distances(outlines, method, bands, em_range, left_names=None, right_names=None, pairs=None):
+    """
+    Pair distances for the per-pair methods, restricted to the given left/right glyphs
+    (and to `pairs`, if given).
+    Works on plain NumPy outline data only, so it can run in a worker process.
+    """
+    if method == "points":
+        return compute_point_distances(outlines, left_names, right_names, pairs=pairs)
+    if method == "profile":
+        profiles, band_height = get_em_profiles(outlines, em_range, bands)
+        return compute_profile_distances(profiles, band_height, left_names, right_names, pairs=pairs)
+    raise ValueError(f"Unknown kerning method: {method}")
+
+def compute_distances_parallel(outlines, method, bands, em_range, left_names, right_names=None, workers=1,
+                               pairs=None):
+    """
+    Shard the left glyphs across a process pool and gather the pair distances.
+    The outlines are already serialized out of fontforge, so they pickle cleanly.
+    """
+    if workers <= 1 or len(left_names) < 2:
+        return compute_distances(outlines, method, bands, em_range, left_names, right_names, pairs)
+
+    shard_count = min(len(left_names), workers * 4)
+    shards = [left_names[i::shard_count] for i in range(shard_count)]
+    distances = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(compute_distances, outlines, method, bands, em_range, shard, right_names, pairs)
+                   for shard in shards]
+        for future in futures:
+            distances += future.result()
+    return distances
+
+def optimize_kerning(font, target_spacing=0, debug=False, method="points", bands=PROFILE_BANDS,
+                     class_tolerance=8, store_path=None, workers=None, fea_path=None, bigram_coverage=None):
     """
     Optimizes kerning for all glyph pairs considering vertical alignment.
+
+    method="points" measures the closest distance between outline points
+    (the reference); method="profile" compares precomputed per-glyph edge
+    profiles over `bands` horizontal bands across the em, which is much
+    cheaper for large character sets. method="classes" clusters glyphs with
+    matching profiles into kerning classes and emits a class-based subtable;
+    every pair value stays within `class_tolerance` units of its profile value.
+
+    With `bigram_coverage` (e.g. 0.999), the per-pair methods only kern the
+    most frequent pairs of the bundled English bigram table that together
+    cover that share of occurrences; other pairs are neither computed nor
+    emitted. Glyphs without any outline points are always skipped.
+
+    With `store_path`, the per-pair distances are kept in a JSON store keyed
+    by glyph name and outline hash; on the next call only pairs involving a
+    glyph whose outline changed are recomputed, the rest are merged back.
+    The hash covers the outline and advance width as they sit in the font
+    (normalized, scaled and tracked), so re-tracing a glyph invalidates its
+    pairs. The whole store is dropped when `method`, `bands` or the em range
+    (ascent, descent and outlines poking out of them) differ.
+
+    The per-pair methods shard left glyphs over `workers` processes
+    (default: the KERNING_WORKERS environment variable, 1 = in-process).
+
+    method="classes" kerns every class pair and only compares class
+    representatives, which is cheap enough in-process; it ignores
+    `bigram_coverage`, `store_path` and `workers` and prints a note when
+    any of them is passed.
+
+    The result is written as an OpenType feature file and merged into the
+    font in one call. Pass `fea_path` to keep that file as an artifact that
+    apply_kerning_feature can reapply later.
     """
     glyphs = [g for g in font.glyphs() if g.isWorthOutputting()]
     if debug:
@@ -41,52 +439,101 @@ def optimize_kerning(font, target_spacing=0, debug=False):
             point_count = sum(len(contour) for contour in layer)
             print(f"First glyph '{glyphs[5].glyphname}' has {point_count} points")
     
-    total_pairs = len(glyphs) * len(glyphs)
-    processed = 0
-    skipped_no_points = 0
+    if method == "classes":
+        ignored = [name for name, value in (("bigram_coverage", bigram_coverage), ("store_path", store_path),
+                                            ("workers", workers)) if value is not None]
+        if ignored:
+            print(f"Kerning classes: ignoring {', '.join(ignored)} (per-pair options only)")
+
+    outlines = extract_outlines(glyphs)
     skipped_no_alignment = 0
-    
+    if workers is None:
+        workers = KERNING_WORKERS
+    temporary_fea = fea_path is None
+    if temporary_fea:
+        fd, fea_path = tempfile.mkstemp(suffix=".fea")
+        os.close(fd)
+
+    if method == "classes":
+        outlines.pop(".notdef", None)
+        profiles, band_height = get_em_profiles(outlines, get_em_range(font, outlines), bands)
+        # Each side may drift by half the tolerance from its class representative;
+        # the pair distance moves at most as much as the profiles do.
+        first_classes = cluster_profiles(
+            {name: width - right for name, (width, _, right) in profiles.items()}, class_tolerance / 2)
+        second_classes = cluster_profiles(
+            {name: left for name, (_, left, _) in profiles.items()}, class_tolerance / 2)
+        distances = compute_profile_distances(
+            profiles, band_height,
+            left_names=[c[0] for c in first_classes],
+            right_names=[c[0] for c in second_classes],
+            include_self=True)
+        class_values = {(left, right): target_spacing - distance for left, right, distance in distances}
+        if debug:
+            print(f"Clustered {len(profiles)} glyphs into {len(first_classes)} left and "
+                  f"{len(second_classes)} right kerning classes ({len(distances)} class pairs)")
+        count = write_class_feature(fea_path, first_classes, second_classes, class_values)
+        apply_kerning_feature(font, fea_path)
+        if temporary_fea:
+            os.remove(fea_path)
+        print(f"Total kerning class pairs: {count}")
+        return
+
+    names = list(outlines)
+    if bigram_coverage is not None:
+        glyph_chars = {g.glyphname: chr(g.unicode) for g in glyphs
+                       if g.unicode >= 0 and g.glyphname in outlines}
+        required = select_kerning_pairs(glyph_chars, bigram_coverage)
+    else:
+        required = {(left, right) for left in names for right in names if left != right}
+
+    hashes = {name: outline_hash(*outlines[name]) for name in names}
+    em_range = get_em_range(font, outlines)
+    distances = []
+    store = load_kerning_store(store_path)
+    if store and store.get("method") == method and store.get("bands") == bands and \
+            store.get("em_range") == list(em_range):
+        unchanged = {name for name in names if store["glyphs"].get(name) == hashes[name]}
+        distances = [(left, right, distance) for left, right, distance in store["distances"]
+                     if left in unchanged and right in unchanged and (left, right) in required]
+
+    missing = required - {(left, right) for left, right, _ in distances}
+    if missing:
+        missing_lefts = {left for left, _ in missing}
+        left_names = [name for name in names if name in missing_lefts]
+        distances += compute_distances_parallel(outlines, method, bands, em_range,
+                                                left_names, workers=workers, pairs=missing)
+    if debug:
+        print(f"Kerning {len(required)} pairs: recomputed {len(missing)}, "
+              f"reused {len(required) - len(missing)} from store")
+
+    if store_path:
+        save_kerning_store(store_path, {
+            "method": method,
+            "bands": bands,
+            "em_range": list(em_range),
+            "target_spacing": target_spacing,
+            "glyphs": hashes,
+            "distances": distances,
+        })
+
     kerning_values = []
-    
-    for left in glyphs:
-        left_name = left.glyphname
-        for right in glyphs:
-            right_name = right.glyphname
-            if left_name == right_name:
-                continue
-            
-            distance = get_aligned_distance(left, right)
-            if distance is None:
-                skipped_no_points += 1
-                continue
-                
-            kerning_value = target_spacing - distance
-            kerning_values.append((left_name, right_name, kerning_value))
+    for left_name, right_name, distance in distances:
+        kerning_value = target_spacing - distance
+        kerning_values.append((left_name, right_name, kerning_value))
 
-            processed += 1
-            if debug and processed % 1000 == 0:
-                print(f"Processed {processed}/{total_pairs} pairs...")
+    processed = len(kerning_values)
+    skipped_no_points = len(glyphs) - len(outlines)
     
     if debug:
         print(f"Kerning optimization complete. Processed {processed} pairs.")
-        print(f"Skipped {skipped_no_points} pairs with no points found")
+        print(f"Skipped {skipped_no_points} glyphs with no points found")
         print(f"Skipped {skipped_no_alignment} pairs with no alignment points")
 
-    count = 0
-    lookup_name = "pair_kerning_lookup"
-    subtable_name = "pair_kerning_subtable"
-    font.addLookup(lookup_name, "gpos_pair", None, (("kern", (("latn", ("dflt")),)),))
-    font.addLookupSubtable(lookup_name, subtable_name)
-    for left_glyph_name, right_glyph_name, kerning_value in kerning_values:
-        if left_glyph_name != '.notdef' or right_glyph_name != '.notdef':
-            left_glyph = font[left_glyph_name]
-            round_kerning_value = round(kerning_value)
-            if abs(round_kerning_value) > 10:
-                left_glyph.addPosSub(subtable_name, right_glyph_name, 
-                0, 0, round_kerning_value, 0,     
-                0, 0, 0, 0)  
-
-                count += 1
+    count = write_pair_feature(fea_path, kerning_values)
+    apply_kerning_feature(font, fea_path)
+    if temporary_fea:
+        os.remove(fea_path)
     print(f"Total kerning pairs: {count}")
 
 if __name__ == "__main__":
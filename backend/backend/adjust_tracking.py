@@ -1,6 +1,6 @@
 import fontforge
 
-def tracking_font(font, map_clusters_to_chars=None, modified_spacing=None):
+def tracking_font(font, map_clusters_to_chars=None, modified_spacing=None, target_spacing=None):
     widths = []
     if map_clusters_to_chars is None:
         # Process all glyphs that have outlines and are not special glyphs
@@ -27,7 +27,8 @@ def tracking_font(font, map_clusters_to_chars=None, modified_spacing=None):
     if widths:
         avg_width = sum(widths) / len(widths)
         print(f"avg_width: {avg_width}")
-        target_spacing = avg_width / 5 
+        if target_spacing is None:
+            target_spacing = avg_width / 5
         if modified_spacing is not None:
             target_spacing = target_spacing + modified_spacing
         for char in chars:
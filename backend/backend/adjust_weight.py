@@ -1,10 +1,114 @@
 import fontforge
+import copy
+import fcntl
+import json
 import os
+import tempfile
 import shutil
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fontTools.designspaceLib import AxisDescriptor, DesignSpaceDocument, InstanceDescriptor, SourceDescriptor
+from fontTools.ttLib import TTFont
+from fontTools.varLib import build as build_variable_font
+from fontTools.varLib.instancer import instantiateVariableFont
 from adjust_tracking import tracking_font
+from job_executor import JOB_WORKERS
+from utils import write_json_atomic
 
-def create_weight_variant(base_font_path, output_dir, variant_name, weight_delta, counter_type="retain"):
+# "static" writes every weight up front, "variable" builds one wght-axis font
+# from a light and a bold master and leaves static weights to be instantiated on demand.
+# "lazy" writes only the default weight; the others are built on first download.
+FONT_OUTPUT_MODE = os.environ.get("FONT_OUTPUT_MODE", "static")
+WEIGHTS = range(100, 1000, 100)
+FONT_FORMATS = ["ttf", "otf", "woff2"]
+LAZY_DEFAULT_WEIGHT = 400
+# Written next to the fonts of a lazy job; tells downloads how to build the missing weights
+ON_DEMAND_MANIFEST = "on_demand.json"
+# Each of the JOB_WORKERS job processes starts its own weight pool, so they share the CPUs
+WEIGHT_WORKERS = int(os.environ.get("WEIGHT_WORKERS", max(1, (os.cpu_count() or 1) // JOB_WORKERS)))
+VARIABLE_FONT_NAME = "MyFont-VF"
+WEIGHT_NAMES = {
+    100: "Thin", 200: "ExtraLight", 300: "Light", 400: "Regular", 500: "Medium",
+    600: "SemiBold", 700: "Bold", 800: "ExtraBold", 900: "Black",
+}
+
+def get_weight_delta(weight, bold_delta=32, light_delta=-32, regular=0):
+    """Stroke delta for a weight, interpolated linearly between light (100) and bold (900)."""
+    factor = (weight - 100) / 800.0  # 800 is the range between 100 and 900
+    return round(light_delta + (bold_delta - light_delta) * factor + regular)
+
+def extract_weight_outlines(font):
+    """
+    Plain-data outlines for every glyph: {name: (width, contours)} where each
+    contour is (closed, [(x, y, on_curve), ...]). Glyphs with references are
+    left out, they always go through changeWeight.
+    """
+    outlines = {}
+    for glyph in font.glyphs():
+        if glyph.references:
+            continue
+        contours = [(contour.closed, [(point.x, point.y, point.on_curve) for point in contour])
+                    for contour in glyph.foreground]
+        outlines[glyph.glyphname] = (glyph.width, contours)
+    return outlines
+
+def compute_weight_master(base_font_path, weight_delta, counter_type="retain"):
+    """Run changeWeight over the whole base font once and return its outlines (see extract_weight_outlines)."""
+    font = fontforge.open(base_font_path)
+    font.selection.all()
+    font.changeWeight(weight_delta, "LCG", 0, 0, counter_type)
+    outlines = extract_weight_outlines(font)
+    font.close()
+    return outlines
+
+def outlines_compatible(outline_a, outline_b):
+    """True if two outlines have the same contours, point counts and on-curve flags."""
+    contours_a, contours_b = outline_a[1], outline_b[1]
+    if len(contours_a) != len(contours_b):
+        return False
+    for (closed_a, points_a), (closed_b, points_b) in zip(contours_a, contours_b):
+        if closed_a != closed_b or len(points_a) != len(points_b):
+            return False
+        if any(point_a[2] != point_b[2] for point_a, point_b in zip(points_a, points_b)):
+            return False
+    return True
+
+def interpolate_weight(font, masters, weight_delta, counter_type="retain"):
+    """
+    Replace the outlines of font with a linear blend of the light and bold
+    masters at weight_delta. Glyphs that cannot be blended get changeWeight
+    on their own. Returns the names of those glyphs.
+    """
+    light_delta, light, bold_delta, bold = masters
+    factor = (weight_delta - light_delta) / (bold_delta - light_delta) if bold_delta != light_delta else 0
+    fallback = []
+    for glyph in font.glyphs():
+        name = glyph.glyphname
+        if name not in light or name not in bold or not outlines_compatible(light[name], bold[name]):
+            fallback.append(name)
+            glyph.changeWeight(weight_delta, "LCG", 0, 0, counter_type)
+            continue
+        (light_width, light_contours), (bold_width, bold_contours) = light[name], bold[name]
+        layer = fontforge.layer()
+        layer.is_quadratic = glyph.foreground.is_quadratic
+        for (closed, light_points), (_, bold_points) in zip(light_contours, bold_contours):
+            contour = fontforge.contour()
+            contour.is_quadratic = layer.is_quadratic
+            for (lx, ly, on_curve), (bx, by, _) in zip(light_points, bold_points):
+                contour += fontforge.point(lx + (bx - lx) * factor, ly + (by - ly) * factor, on_curve)
+            contour.closed = closed
+            layer += contour
+        glyph.foreground = layer
+        glyph.width = round(light_width + (bold_width - light_width) * factor)
+    return fallback
+
+def create_weight_variant(base_font_path, output_dir, variant_name, weight_delta, counter_type="retain",
+                          masters=None):
+    """
+    Build one weight variant. With masters (light_delta, light_outlines,
+    bold_delta, bold_outlines) the outlines are interpolated between them
+    instead of running changeWeight over the whole font.
+    """
     # Open the base font
     base_font = fontforge.open(base_font_path)
     
@@ -13,11 +117,14 @@ def create_weight_variant(base_font_path, output_dir, variant_name, weight_delta
     base_font.fullname = base_font.fullname + f" {variant_name}"
     base_font.weight = variant_name
     
-    # Select all glyphs
-    base_font.selection.all()
-    
     # Adjust the stroke weight
-    base_font.changeWeight(weight_delta, "LCG", 0, 0, counter_type)
+    if masters is None:
+        base_font.selection.all()
+        base_font.changeWeight(weight_delta, "LCG", 0, 0, counter_type)
+    else:
+        fallback = interpolate_weight(base_font, masters, weight_delta, counter_type)
+        if fallback:
+            print(f"changeWeight fallback for {variant_name}: {fallback}")
     base_font, target_spacing = tracking_font(base_font, modified_spacing=abs(weight_delta))
 
     print(f"target_spacing: {target_spacing}")
@@ -28,7 +135,240 @@ def create_weight_variant(base_font_path, output_dir, variant_name, weight_delta
     base_font.generate(os.path.join(output_dir, f"MyFont-{variant_name}.woff2"))
     base_font.close()
 
-def create_all_variants(base_font_path, output_dir, bold_delta=32, light_delta=-32, regular=0):
+def build_weight_master(base_font_path, master_path, weight, weight_delta):
+    """Apply one stroke delta plus matching tracking to the base font and save it as a TrueType master."""
+    font = fontforge.open(base_font_path)
+    font.weight = WEIGHT_NAMES[weight]
+    if weight_delta != 0:
+        font.selection.all()
+        font.changeWeight(weight_delta, "LCG", 0, 0, "retain")
+        font, _ = tracking_font(font, modified_spacing=abs(weight_delta))
+    font.generate(master_path)
+    font.close()
+
+def glyphs_compatible(glyph_a, glyph_b):
+    """True if two glyf glyphs have the same contour structure and on-curve flags."""
+    if glyph_a.numberOfContours != glyph_b.numberOfContours:
+        return False
+    if glyph_a.numberOfContours <= 0:
+        return glyph_a.numberOfContours == 0 or glyph_a.components == glyph_b.components
+    return (list(glyph_a.endPtsOfContours) == list(glyph_b.endPtsOfContours) and
+            [flag & 1 for flag in glyph_a.flags] == [flag & 1 for flag in glyph_b.flags])
+
+def make_masters_compatible(light, bold):
+    """
+    changeWeight does not always keep the point structure of a glyph. Where the
+    two masters disagree, copy the light outline into the bold master so the
+    glyph simply does not vary. Returns the names of the glyphs that were fixed.
+    """
+    light_glyf, bold_glyf = light["glyf"], bold["glyf"]
+    fixed = []
+    for name in light.getGlyphOrder():
+        if glyphs_compatible(light_glyf[name], bold_glyf[name]):
+            continue
+        bold_glyf[name] = copy.deepcopy(light_glyf[name])
+        bold_glyf[name].recalcBounds(bold_glyf)
+        advance, _ = bold["hmtx"][name]
+        bold["hmtx"][name] = (advance, getattr(bold_glyf[name], "xMin", 0))
+        fixed.append(name)
+    return fixed
+
+def create_variable_font(base_font_path, output_dir, bold_delta=32, light_delta=-32, regular=0):
+    """
+    Build a light (100) and a bold (900) master and assemble a single
+    wght-axis variable font with named instances for 100-900.
+    Writes MyFont-VF.ttf and MyFont-VF.woff2; returns the TTF path.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    masters_dir = os.path.join(output_dir, "masters")
+    os.makedirs(masters_dir, exist_ok=True)
+
+    masters = {}
+    for weight in (100, 900):
+        master_path = os.path.join(masters_dir, f"MyFont-master-{weight}.ttf")
+        build_weight_master(base_font_path, master_path, weight,
+                            get_weight_delta(weight, bold_delta, light_delta, regular))
+        masters[weight] = TTFont(master_path)
+
+    fixed = make_masters_compatible(masters[100], masters[900])
+    if fixed:
+        print(f"Glyphs kept static across weights (incompatible masters): {fixed}")
+
+    doc = DesignSpaceDocument()
+    axis = AxisDescriptor()
+    axis.tag, axis.name = "wght", "Weight"
+    axis.minimum, axis.default, axis.maximum = 100, 100, 900
+    doc.addAxis(axis)
+    for weight, master in masters.items():
+        source = SourceDescriptor()
+        source.font = master
+        source.name = f"master-{weight}"
+        source.location = {"Weight": weight}
+        doc.addSource(source)
+    for weight in WEIGHTS:
+        instance = InstanceDescriptor()
+        instance.familyName = "MyFont"
+        instance.styleName = WEIGHT_NAMES[weight]
+        instance.location = {"Weight": weight}
+        doc.addInstance(instance)
+
+    variable_font, _, _ = build_variable_font(doc)
+    variable_font_path = os.path.join(output_dir, f"{VARIABLE_FONT_NAME}.ttf")
+    variable_font.save(variable_font_path)
+    variable_font.flavor = "woff2"
+    variable_font.save(os.path.join(output_dir, f"{VARIABLE_FONT_NAME}.woff2"))
+    shutil.rmtree(masters_dir, ignore_errors=True)
+
+    # Static weights instantiated from an older build are stale now
+    for weight in WEIGHTS:
+        for ext in ["ttf", "otf", "woff2"]:
+            stale_path = os.path.join(output_dir, f"MyFont-{weight}.{ext}")
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+    return variable_font_path
+
+def instantiate_weight(variable_font_path, output_dir, weight):
+    """
+    Produce the static TTF/OTF/WOFF2 trio for one weight from the variable font.
+    The OTF is converted from the instance TTF with fontforge.
+    """
+    instance = instantiateVariableFont(TTFont(variable_font_path), {"wght": weight})
+    ttf_path = os.path.join(output_dir, f"MyFont-{weight}.ttf")
+    instance.save(ttf_path)
+    instance.flavor = "woff2"
+    instance.save(os.path.join(output_dir, f"MyFont-{weight}.woff2"))
+
+    font = fontforge.open(ttf_path)
+    font.generate(os.path.join(output_dir, f"MyFont-{weight}.otf"))
+    font.close()
+
+def build_static_weight(base_font_path, output_dir, weight, weight_delta, masters=None):
+    """
+    Build the TTF/OTF/WOFF2 trio for one weight. Opens the base font itself,
+    so it can run in a worker process. Returns the paths that exist.
+    """
+    if weight_delta == 0:
+        # For weight_delta 0, we need to properly generate each format
+        base_font = fontforge.open(base_font_path)
+        base_font.fontname = base_font.fontname + f"-{weight}"
+        base_font.fullname = base_font.fullname + f" {weight}"
+        base_font.weight = str(weight)
+        
+        # Generate all formats
+        base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.ttf"))
+        base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.otf"))
+        base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.woff2"))
+        base_font.close()
+    else:
+        # Create the weight variant
+        create_weight_variant(base_font_path, output_dir, str(weight), weight_delta, masters=masters)
+
+    font_files = [os.path.join(output_dir, f"MyFont-{weight}.{ext}") for ext in ["ttf", "otf", "woff2"]]
+    return [font_file for font_file in font_files if os.path.exists(font_file)]
+
+def weight_artifacts(weight, font_files):
+    """Download format names ("400-woff2", ...) for the files of one weight."""
+    return [f"{weight}-{os.path.splitext(font_file)[1][1:]}" for font_file in font_files]
+
+def lazy_job(output_dir):
+    """True if output_dir holds fonts of a lazy job, whose other weights are built on demand."""
+    return os.path.exists(os.path.join(output_dir, ON_DEMAND_MANIFEST))
+
+def build_weight_once(output_dir, weight, build):
+    """
+    Run build(build_dir) unless all files of the weight exist. Concurrent
+    calls (threads or processes) for the same weight wait on a file lock and
+    reuse the first build. build writes MyFont-{weight}.* into a temp dir and
+    the files are renamed into place, so downloads never see a partial font.
+    Returns the paths of the weight that exist.
+    """
+    font_files = [os.path.join(output_dir, f"MyFont-{weight}.{ext}") for ext in FONT_FORMATS]
+    with open(os.path.join(output_dir, f".MyFont-{weight}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not all(os.path.exists(font_file) for font_file in font_files):
+                build_dir = tempfile.mkdtemp(dir=output_dir, prefix=".build-")
+                try:
+                    build(build_dir)
+                    for ext in FONT_FORMATS:
+                        built_file = os.path.join(build_dir, f"MyFont-{weight}.{ext}")
+                        if os.path.exists(built_file):
+                            os.replace(built_file, os.path.join(output_dir, os.path.basename(built_file)))
+                finally:
+                    shutil.rmtree(build_dir, ignore_errors=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return [font_file for font_file in font_files if os.path.exists(font_file)]
+
+def ensure_weight_variant(output_dir, weight):
+    """Build one weight of a lazy job if it does not exist yet. Returns the download format names."""
+    with open(os.path.join(output_dir, ON_DEMAND_MANIFEST), "r") as f:
+        manifest = json.load(f)
+
+    def build(build_dir):
+        print(f"Building weight {weight} on demand in {output_dir}")
+        base_font_path = os.path.join(output_dir, manifest["base_font"])
+        build_static_weight(base_font_path, build_dir, weight, manifest["weight_deltas"][str(weight)])
+
+    return weight_artifacts(weight, build_weight_once(output_dir, weight, build))
+
+def ensure_weight_instance(variable_font_path, output_dir, weight):
+    """Instantiate one static weight of a variable-font job if it does not exist yet. Returns the download format names."""
+    def build(build_dir):
+        print(f"Instantiating weight {weight} on demand in {output_dir}")
+        instantiate_weight(variable_font_path, build_dir, weight)
+
+    return weight_artifacts(weight, build_weight_once(output_dir, weight, build))
+
+def ensure_variants_zip(output_dir):
+    """Build every missing weight of a lazy job, then the zip of all of them. Returns the format names built."""
+    artifacts = []
+    for weight in WEIGHTS:
+        artifacts += ensure_weight_variant(output_dir, weight)
+
+    zip_file = os.path.join(output_dir, "MyFont.zip")
+    with open(os.path.join(output_dir, ".MyFont-zip.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(zip_file):
+                tmp_path = f"{zip_file}.{os.getpid()}.tmp"
+                with zipfile.ZipFile(tmp_path, 'w') as zipf:
+                    for weight in WEIGHTS:
+                        for ext in FONT_FORMATS:
+                            font_file = os.path.join(output_dir, f"MyFont-{weight}.{ext}")
+                            if os.path.exists(font_file):
+                                zipf.write(font_file, arcname=os.path.basename(font_file))
+                os.replace(tmp_path, zip_file)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return artifacts + ["zipped-fonts"]
+
+def create_lazy_variants(base_font_path, output_dir, weight_deltas, progress):
+    """
+    Build only the default weight and record how to build the others, which
+    /download-font does on first request.
+    """
+    # Weights and zip of an earlier build came from a different base font
+    for weight in WEIGHTS:
+        for ext in FONT_FORMATS:
+            stale_path = os.path.join(output_dir, f"MyFont-{weight}.{ext}")
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+    zip_file = os.path.join(output_dir, "MyFont.zip")
+    if os.path.exists(zip_file):
+        os.remove(zip_file)
+
+    font_files = build_static_weight(base_font_path, output_dir, LAZY_DEFAULT_WEIGHT, weight_deltas[LAZY_DEFAULT_WEIGHT])
+    write_json_atomic(os.path.join(output_dir, ON_DEMAND_MANIFEST), {
+        "base_font": os.path.relpath(base_font_path, output_dir),
+        "weight_deltas": {str(weight): delta for weight, delta in weight_deltas.items()},
+    })
+    on_demand = [f"{weight}-{ext}" for weight in WEIGHTS if weight != LAZY_DEFAULT_WEIGHT for ext in FONT_FORMATS]
+    progress(f"Weight {LAZY_DEFAULT_WEIGHT} generated, other weights available on demand",
+             weight_artifacts(LAZY_DEFAULT_WEIGHT, font_files), on_demand=on_demand + ["zipped-fonts"])
+
+def create_all_variants(base_font_path, output_dir, bold_delta=32, light_delta=-32, regular=0, mode=None,
+                        workers=None, progress=None):
     """
     Create all weight variants from 100 to 900.
     
@@ -37,46 +377,72 @@ def create_all_variants(base_font_path, output_dir, bold_delta=32, light_delta=-
         output_dir: Directory to save the variants
         bold_delta: Weight delta for bold variant (default 32)
         light_delta: Weight delta for light variant (default -32)
+        mode: "static" (nine weights x three formats), "variable" (one
+            wght-axis font, statics on demand) or "lazy" (default weight
+            only, others on demand); defaults to FONT_OUTPUT_MODE
+        workers: processes building static weights in parallel; defaults to WEIGHT_WORKERS
+        progress: optional progress(info_message, artifacts, on_demand) called as weights become available
     """
+    if mode is None:
+        mode = FONT_OUTPUT_MODE
+    if progress is None:
+        progress = lambda info_message, artifacts=(), on_demand=(): None
+
     # Standard weight values from 100 to 900
-    weights = range(100, 1000, 100)
+    weights = WEIGHTS
+    if mode != "lazy" and lazy_job(output_dir):
+        # Rebuilt in another mode; downloads must not build weights from the old manifest
+        os.remove(os.path.join(output_dir, ON_DEMAND_MANIFEST))
     
     # Create a single zip file
     zip_file = os.path.join(output_dir, "MyFont.zip")
+
+    if mode == "variable":
+        create_variable_font(base_font_path, output_dir, bold_delta, light_delta, regular)
+        with zipfile.ZipFile(zip_file, 'w') as zipf:
+            for ext in ["ttf", "woff2"]:
+                font_file = os.path.join(output_dir, f"{VARIABLE_FONT_NAME}.{ext}")
+                zipf.write(font_file, arcname=os.path.basename(font_file))
+        progress("Variable font generated", ["variable-ttf", "variable-woff2"] +
+                 [f"{weight}-{ext}" for weight in weights for ext in ["ttf", "otf", "woff2"]])
+        return
     
-    for weight in weights:
-        # Calculate the interpolation factor (0.0 to 1.0)
-        factor = (weight - 100) / 800.0  # 800 is the range between 100 and 900
-        
-        # Interpolate between light and bold deltas
-        weight_delta = light_delta + (bold_delta - light_delta) * factor
-        weight_delta = weight_delta + regular
-        weight_delta = round(weight_delta)
-        print(f"weight_delta: {weight_delta}")
-
-        if weight_delta == 0:
-            # For weight_delta 0, we need to properly generate each format
-            base_font = fontforge.open(base_font_path)
-            base_font.fontname = base_font.fontname + f"-{weight}"
-            base_font.fullname = base_font.fullname + f" {weight}"
-            base_font.weight = str(weight)
-            
-            # Generate all formats
-            base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.ttf"))
-            base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.otf"))
-            base_font.generate(os.path.join(output_dir, f"MyFont-{weight}.woff2"))
-            base_font.close()
-        else:
-            # Create the weight variant
-            create_weight_variant(base_font_path, output_dir, str(weight), weight_delta)
-    
-    # Add all files to a single zip file
+    if workers is None:
+        workers = WEIGHT_WORKERS
+    os.makedirs(output_dir, exist_ok=True)
+    weight_deltas = {weight: get_weight_delta(weight, bold_delta, light_delta, regular) for weight in weights}
+    print(f"weight_deltas: {weight_deltas}")
+
+    if mode == "lazy":
+        create_lazy_variants(base_font_path, output_dir, weight_deltas, progress)
+        return
+
+    # changeWeight runs only for the two extremes; every weight in between
+    # (and the extremes themselves) is blended from these outlines.
+    light_delta, bold_delta = weight_deltas[min(weights)], weight_deltas[max(weights)]
+
+    # Add each weight's files to the zip as soon as that weight is done
     with zipfile.ZipFile(zip_file, 'w') as zipf:
-        for weight in weights:
-            for ext in ["ttf", "otf", "woff2"]:
-                font_file = os.path.join(output_dir, f"MyFont-{weight}.{ext}")
-                if os.path.exists(font_file):
+        if workers <= 1:
+            masters = (light_delta, compute_weight_master(base_font_path, light_delta),
+                       bold_delta, compute_weight_master(base_font_path, bold_delta))
+            for weight, weight_delta in weight_deltas.items():
+                font_files = build_static_weight(base_font_path, output_dir, weight, weight_delta, masters)
+                for font_file in font_files:
+                    zipf.write(font_file, arcname=os.path.basename(font_file))
+                progress(f"Weight {weight} generated", weight_artifacts(weight, font_files))
+            return
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(weight_deltas))) as pool:
+            light, bold = pool.map(compute_weight_master, [base_font_path] * 2, [light_delta, bold_delta])
+            masters = (light_delta, light, bold_delta, bold)
+            futures = {pool.submit(build_static_weight, base_font_path, output_dir, weight, weight_delta, masters): weight
+                       for weight, weight_delta in weight_deltas.items()}
+            for future in as_completed(futures):
+                font_files = future.result()
+                for font_file in font_files:
                     zipf.write(font_file, arcname=os.path.basename(font_file))
+                progress(f"Weight {futures[future]} generated", weight_artifacts(futures[future], font_files))
 
 if __name__ == "__main__":
     # Example usage
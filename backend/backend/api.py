@@ -1,25 +1,95 @@
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import hashlib
 import os
 import shutil
 from pathlib import Path
 import uuid
 import json
-from image_processing import load_and_threshold_image
+from image_processing import decode_image, load_and_threshold_image
 from svg_generation import trace_bitmap_to_svg_paths
 from glyph_segmentation import merge_glyph_paths
 from font_generation import create_font_from_glyphs
 from font_regen import build_replacement_font, drop_in_replacement
-from generate_base_img import generate_base_image_replicate
+from image_cache import get_base_image
 from improve_prompt import generate_prompt
 from font_normalization import normalize_glyph_heights
 import uvicorn
 import datetime
 from regenerate_missing_img import generate_missing_glyphs_image
+from adjust_weight import (FONT_OUTPUT_MODE, VARIABLE_FONT_NAME, ensure_weight_instance, lazy_job,
+                           ensure_weight_variant, ensure_variants_zip)
+from job_executor import QueueFull, submit_job, submit_task, shutdown_executor
+from job_store import init_store, update_job, get_job, get_events, job_progress, list_jobs
+from utils import write_file_atomic, write_json_atomic
+from checkpoints import PIPELINE_STAGES, load_checkpoint, save_checkpoint, pending_stages
+import result_cache
+from retention import start_retention_thread, touch_job
 
 app = FastAPI()
 
+# How often /font-events checks the job store for new events, and how many
+# empty checks pass before a keep-alive comment is sent
+FONT_EVENTS_POLL_SECONDS = 0.5
+FONT_EVENTS_KEEPALIVE_POLLS = 30
+
+# Result cache key -> job currently computing it, so a retried upload joins that job
+inflight_uploads = {}
+
+# Uploads larger than this are rejected with 413, from Content-Length before
+# the form is parsed, or while reading when the body is sent chunked
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Multipart boundaries and the other form fields sent along with the image
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+class UploadRejected(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+async def ingest_upload(file):
+    """
+    Read an uploaded image in chunks without blocking the event loop and
+    decode it in memory. Returns (bytes, sha256 hex digest, grayscale array).
+    Raises UploadRejected for oversized (413) or undecodable (400) uploads.
+    """
+    data = bytearray()
+    digest = hashlib.sha256()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        data += chunk
+        digest.update(chunk)
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise UploadRejected(413, f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    data = bytes(data)
+    try:
+        image = await run_in_threadpool(decode_image, data)
+    except ValueError:
+        raise UploadRejected(400, "Uploaded file is not a readable image")
+    return data, digest.hexdigest(), image
+
+def upload_rejected_response(error):
+    return JSONResponse(status_code=error.status_code, content={"error": str(error), "message": str(error)})
+
+def write_upload(path, data):
+    """Persist the original upload bytes; runs after the response has been sent."""
+    write_file_atomic(str(path), data)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Answer 413 before Starlette spools a multipart body that is too large anyway."""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+        return upload_rejected_response(
+            UploadRejected(413, f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"))
+    return await call_next(request)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -33,13 +103,97 @@ app.add_middleware(
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("output", exist_ok=True)
 os.makedirs("debug", exist_ok=True)
+init_store()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    shutdown_executor()
+
+def queue_full_response(error):
+    return JSONResponse(status_code=503, content={"error": str(error), "message": "Server is busy, please try again shortly"})
+
+@app.on_event("startup")
+def start_retention():
+    start_retention_thread()
+
+@app.on_event("startup")
+def resume_unfinished_jobs():
+    """Queue font jobs again that were interrupted by a restart; they continue from their checkpoints."""
+    for job in list_jobs("processing"):
+        job_id = job["job_id"]
+        if job["regeneration_status"] == "in_progress":
+            update_job(job_id, status="failed", regeneration_status="failed", info_message="Regeneration interrupted",
+                       error="Server restarted during regeneration")
+            continue
+        try:
+            requeue_font_job(job_id)
+        except QueueFull:
+            # requeue_font_job has already marked it failed
+            pass
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def requeue_font_job(job_id):
+    """
+    Submit the font pipeline of an existing job again. Jobs with a base image
+    go straight to process_font; prompt jobs without one start from the saved
+    prompt. Returns False if the job has no input left to work from.
+    """
+    job_dir = Path(f"uploads/{job_id}")
+    output_dir = Path(f"output/{job_id}")
+    debug_dir = Path(f"debug/{job_id}")
+    os.makedirs(debug_dir, exist_ok=True)
+
+    base_images = [path for path in sorted(job_dir.glob("base_image.*")) if path.suffix != ".tmp"]
+    if base_images and not (job_dir / "prompt.txt").exists():
+        # Uploaded image: the result goes to the result cache like a fresh upload
+        key = result_cache.cache_key(file_sha256(base_images[0]), FONT_OUTPUT_MODE)
+        job = (process_font, str(base_images[0]), str(output_dir), str(debug_dir), job_id, key)
+    elif base_images:
+        job = (process_font, str(base_images[0]), str(output_dir), str(debug_dir), job_id)
+    elif (job_dir / "prompt.txt").exists():
+        prompt = (job_dir / "prompt.txt").read_text()
+        job = (process_prompt_to_font, prompt, str(job_dir), str(output_dir), str(debug_dir), job_id)
+    else:
+        update_job(job_id, status="failed", info_message="Font generation failed", error="Job input not found")
+        return False
+
+    update_job(job_id, status="processing", info_message="Resuming font generation")
+    try:
+        submit_job(job_id, *job)
+    except QueueFull as e:
+        update_job(job_id, status="failed", info_message="Server busy", error=str(e))
+        raise
+    return True
+
+@app.post("/resume-font/{job_id}")
+async def resume_font(job_id: str):
+    """Restart a failed font job from its last completed stage."""
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        return {"error": "Job not found"}
+    if job["status"] != "failed":
+        return {"error": f"Only failed jobs can be resumed; this one is {job['status']}"}
+    if job["regeneration_status"] is not None:
+        return {"error": "This font was regenerated; start the regeneration again instead"}
+    try:
+        if not await run_in_threadpool(requeue_font_job, job_id):
+            return {"error": "No base image or prompt found for this job"}
+    except QueueFull as e:
+        return queue_full_response(e)
+    return {"job_id": job_id, "message": "Font generation resumed"}
 
 @app.get("/")
 def read_root():
     return {"message": "Font Generator API is running"}
 
 @app.post("/generate-from-prompt")
-async def generate_font_from_prompt(background_tasks: BackgroundTasks, prompt: str = Form(...)):
+async def generate_font_from_prompt(prompt: str = Form(...)):
     # Create a unique ID for this job
     job_id = str(uuid.uuid4())
     
@@ -51,16 +205,26 @@ async def generate_font_from_prompt(background_tasks: BackgroundTasks, prompt: s
     os.makedirs(job_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(debug_dir, exist_ok=True)
+    # Kept so the job can be restarted after a server restart
+    await run_in_threadpool(write_file_atomic, str(job_dir / "prompt.txt"), prompt)
+    await run_in_threadpool(update_job, job_id, status="processing", info_message="just got started")
 
-    # Process the prompt in the background
-    background_tasks.add_task(
-        process_prompt_to_font,
-        prompt,
-        str(job_dir),
-        str(output_dir),
-        str(debug_dir),
-        job_id
-    )
+    # Queue the prompt for a worker process
+    try:
+        submit_job(
+            job_id,
+            process_prompt_to_font,
+            prompt,
+            str(job_dir),
+            str(output_dir),
+            str(debug_dir),
+            job_id
+        )
+    except QueueFull as e:
+        for directory in (job_dir, output_dir, debug_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+        await run_in_threadpool(update_job, job_id, status="failed", info_message="Server busy", error=str(e))
+        return queue_full_response(e)
     
     return {
         "job_id": job_id,
@@ -69,38 +233,63 @@ async def generate_font_from_prompt(background_tasks: BackgroundTasks, prompt: s
 
 def process_prompt_to_font(prompt, job_dir, output_dir, debug_dir, job_id):
     try:
+        # Retention may have expired the debug dir of an older job
+        os.makedirs(debug_dir, exist_ok=True)
         # Step 1: Improve prompt and generate base image
         output_dir_path = Path(output_dir)
         job_dir_path = Path(job_dir)
-        better_prompt, prompt_message = generate_prompt(prompt)
         saved_prompt_path = job_dir_path / "better_prompt.txt"
-        with open(saved_prompt_path, "w") as f:
-            f.write(better_prompt)
-        saved_prompt_message_path = job_dir_path / "prompt_message.txt"
-        with open(saved_prompt_message_path, "w") as f:
-            f.write(prompt_message)
-
-        base_image_path = generate_base_image_replicate(better_prompt)
-        
-        # Save the generated image to job directory
-        
         saved_image_path = job_dir_path / "base_image.png"
-        shutil.copy(base_image_path, saved_image_path)
+        # A resumed job keeps the prompt and the (paid) image from its earlier attempt
+        if saved_prompt_path.exists():
+            better_prompt = saved_prompt_path.read_text()
+        else:
+            better_prompt, prompt_message = generate_prompt(prompt)
+            saved_prompt_message_path = job_dir_path / "prompt_message.txt"
+            with open(saved_prompt_message_path, "w") as f:
+                f.write(prompt_message)
+            write_file_atomic(str(saved_prompt_path), better_prompt)
+        update_job(job_id, info_message="Prompt improved", artifacts=["better-prompt"])
+
+        image = None
+        if not saved_image_path.exists():
+            # Identical prompts share one generation through the prompt image cache
+            base_image = get_base_image(better_prompt)
+            # Decoded once here and handed straight to thresholding
+            image = decode_image(base_image)
+            
+            # Keep the generated image in the job directory as an artifact
+            write_file_atomic(str(saved_image_path), base_image)
+        update_job(job_id, info_message="Base image generated", artifacts=["base-image"])
         
         # Step 2: Start font generation
         process_font(
             str(saved_image_path),
             output_dir,
             debug_dir,
-            job_id
+            job_id,
+            image=image
         )
     except Exception as e:
+        update_job(job_id, status="failed", info_message="Font generation failed", error=str(e))
         print(f"Error processing prompt to font: {e}")
         import traceback
         traceback.print_exc()
 
+def materialize_cached(key, output_dir):
+    """Link the cached result for key into output_dir. Returns its cache entry, or None on a miss."""
+    cached = result_cache.lookup(key)
+    if cached is not None and result_cache.materialize(key, output_dir):
+        return cached
+    return None
+
 @app.post("/generate-font")
 async def generate_font(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    try:
+        data, digest, image = await ingest_upload(file)
+    except UploadRejected as e:
+        return upload_rejected_response(e)
+
     # Create a unique ID for this job
     job_id = str(uuid.uuid4())
     
@@ -113,26 +302,82 @@ async def generate_font(background_tasks: BackgroundTasks, file: UploadFile = Fi
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(debug_dir, exist_ok=True)
     
-    # Save the uploaded file
-    file_extension = os.path.splitext(file.filename)[1]
+    file_extension = os.path.splitext(file.filename or "")[1]
     file_path = job_dir / f"base_image{file_extension}"
     print(f"file_path: {file_path}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    key = result_cache.cache_key(digest, FONT_OUTPUT_MODE)
+    base_image_artifacts = ["base-image"] if file_path.name == "base_image.png" else []
+
+    # The same image is still being processed (e.g. a retried upload): hand out that job
+    running_job_id = inflight_uploads.get(key)
+    if running_job_id is not None:
+        running_job = await run_in_threadpool(get_job, running_job_id)
+        if running_job is not None and running_job["status"] == "processing":
+            for directory in (job_dir, output_dir, debug_dir):
+                shutil.rmtree(directory, ignore_errors=True)
+            return {"job_id": running_job_id, "message": "Font generation already running for this image"}
+        del inflight_uploads[key]
+
+    # The same image was processed before: link its fonts into this job
+    cached = await run_in_threadpool(materialize_cached, key, str(output_dir))
+    if cached is not None:
+        background_tasks.add_task(write_upload, file_path, data)
+        await run_in_threadpool(update_job, job_id, status="completed", info_message="Font generated",
+                                artifacts=base_image_artifacts + cached["artifacts"], on_demand=cached.get("on_demand", []))
+        return {"job_id": job_id, "message": "Font generated from cache"}
+
+    await run_in_threadpool(update_job, job_id, status="processing", info_message="just got started",
+                            artifacts=base_image_artifacts)
     
-    # Process the font in the background
-    background_tasks.add_task(
-        process_font, 
-        str(file_path), 
-        str(output_dir), 
-        str(debug_dir),
-        job_id
-    )
+    # Queue the font for a worker process
+    try:
+        submit_job(
+            job_id,
+            process_font, 
+            str(file_path), 
+            str(output_dir), 
+            str(debug_dir),
+            job_id,
+            key,
+            image
+        )
+    except QueueFull as e:
+        for directory in (job_dir, output_dir, debug_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+        await run_in_threadpool(update_job, job_id, status="failed", info_message="Server busy", error=str(e))
+        return queue_full_response(e)
+    inflight_uploads[key] = job_id
+    # Save the uploaded file once the response is out; the pipeline works from the decoded image
+    background_tasks.add_task(write_upload, file_path, data)
     
     return {"job_id": job_id, "message": "Font generation started"}
 
 @app.get("/font-status/{job_id}")
 async def font_status(job_id: str):
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        # Jobs created before the job store only exist on disk
+        return await run_in_threadpool(legacy_font_status, job_id)
+
+    result = {
+        "status": job["status"],
+        "info-message": job["info_message"],
+        # Formats built on first download are offered like the others
+        "available_formats": job["artifacts"] + job["on_demand"],
+    }
+    if job["on_demand"]:
+        # Lazy jobs: the subset of available_formats whose download builds it first
+        result["on_demand_formats"] = job["on_demand"]
+    if job["regeneration_status"]:
+        result["regeneration_status"] = job["regeneration_status"]
+        if job["regeneration_time"]:
+            result["regeneration_time"] = job["regeneration_time"]
+    if job["status"] == "failed" and job["error"]:
+        result["error"] = job["error"]
+    return result
+
+def legacy_font_status(job_id):
+    """Status of a job that is not in the job store, worked out from the files it produced."""
     output_dir = Path(f"output/{job_id}")
     job_dir = Path(f"uploads/{job_id}")
     base_image_path = job_dir / "base_image.png"
@@ -183,6 +428,16 @@ async def font_status(job_id: str):
         if "regeneration_status" not in result:
             result["info-message"] = "Glyphs detected"
 
+    # A variable font covers every weight; statics are instantiated on download
+    if (fonts_dir / f"{VARIABLE_FONT_NAME}.woff2").exists():
+        result["available_formats"] += ["variable-ttf", "variable-woff2"]
+        for weight in range(100, 1000, 100):
+            result["available_formats"] += [f"{weight}-ttf", f"{weight}-otf", f"{weight}-woff2"]
+        if "regeneration_status" not in result or result["regeneration_status"] == "completed":
+            result["status"] = "completed"
+            result["info-message"] = "Font generated"
+        return result
+
     # Check for all weight variants (100-900)
     for weight in range(100, 1000, 100):
         ttf_path = fonts_dir / f"MyFont-{weight}.ttf"
@@ -202,14 +457,69 @@ async def font_status(job_id: str):
     
     return result
 
+def format_event(data):
+    """Event payload in the same vocabulary as /font-status."""
+    event = {"new_formats": data.get("artifacts", []) + data.get("on_demand", [])}
+    for field in ("status", "regeneration_status", "regeneration_time", "error"):
+        if data.get(field) is not None:
+            event[field] = data[field]
+    if data.get("info_message") is not None:
+        event["info-message"] = data["info_message"]
+    return event
+
+@app.get("/font-events/{job_id}")
+async def font_events(job_id: str, request: Request):
+    """
+    Server-sent events for one job. Replays what happened since Last-Event-ID
+    (everything on a fresh connection), then streams each stage as the
+    pipeline records it and closes once the job is completed or failed.
+    """
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    try:
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = 0
+
+    async def stream():
+        after_id = last_event_id
+        status = job["status"]
+        idle_polls = 0
+        while not await request.is_disconnected():
+            events = await run_in_threadpool(get_events, job_id, after_id)
+            for event_id, data in events:
+                after_id = event_id
+                status = data.get("status", status)
+                yield f"id: {event_id}\nevent: progress\ndata: {json.dumps(format_event(data))}\n\n"
+            if status in ("completed", "failed"):
+                yield f"event: end\ndata: {json.dumps({'status': status})}\n\n"
+                return
+            idle_polls = 0 if events else idle_polls + 1
+            if idle_polls >= FONT_EVENTS_KEEPALIVE_POLLS:
+                idle_polls = 0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(FONT_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/download-font/{job_id}/{format}")
 async def download_font(job_id: str, format: str):
+    # Downloads keep a job at the back of the retention LRU
+    await run_in_threadpool(touch_job, job_id)
     output_dir = Path(f"output/{job_id}")
     fonts_dir = output_dir / "fonts"
 
     if format.lower() == "zipped-fonts":
         font_path = fonts_dir / "MyFont.zip"
         filename = "MyFont.zip"
+        if not font_path.exists() and lazy_job(str(fonts_dir)):
+            try:
+                built = await asyncio.wrap_future(submit_task(ensure_variants_zip, str(fonts_dir)))
+            except QueueFull as e:
+                return queue_full_response(e)
+            await run_in_threadpool(update_job, job_id, artifacts=built)
         if not font_path.exists():
             return {"error": f"File {filename} not found. It may still be processing or failed to generate."}
         return FileResponse(path=str(font_path), filename=filename)
@@ -221,6 +531,14 @@ async def download_font(job_id: str, format: str):
             return {"error": f"File {filename} not found. It may still be processing or failed to generate."}
         return FileResponse(path=str(font_path), filename=filename)
 
+    if format.lower() in ("variable-ttf", "variable-woff2"):
+        font_format = format.lower().split("-")[1]
+        filename = f"{VARIABLE_FONT_NAME}.{font_format}"
+        font_path = fonts_dir / filename
+        if not font_path.exists():
+            return {"error": f"File {filename} not found. It may still be processing or failed to generate."}
+        return FileResponse(path=str(font_path), filename=filename)
+
     # Parse format string (e.g., "400-ttf", "700-otf", "900-woff2")
     try:
         weight, font_format = format.lower().split("-")
@@ -235,6 +553,23 @@ async def download_font(job_id: str, format: str):
     except ValueError:
         return {"error": "Invalid format. Use format like '400-ttf', '700-otf', or '900-woff2'"}
     
+    # Static weights of a variable-font job are instantiated on first request, in a worker process
+    variable_font_path = fonts_dir / f"{VARIABLE_FONT_NAME}.ttf"
+    if not font_path.exists() and variable_font_path.exists():
+        try:
+            await asyncio.wrap_future(submit_task(ensure_weight_instance, str(variable_font_path), str(fonts_dir), weight))
+        except QueueFull as e:
+            return queue_full_response(e)
+
+    # Other weights of a lazy job are built once, by the first request for them,
+    # in a worker process; the build lock is taken there
+    if not font_path.exists() and lazy_job(str(fonts_dir)):
+        try:
+            built = await asyncio.wrap_future(submit_task(ensure_weight_variant, str(fonts_dir), weight))
+        except QueueFull as e:
+            return queue_full_response(e)
+        await run_in_threadpool(update_job, job_id, artifacts=built)
+
     # Check if the file exists before trying to serve it
     if not font_path or not font_path.exists():
         return {"error": f"File {filename} not found. It may still be processing or failed to generate."}
@@ -244,7 +579,7 @@ async def download_font(job_id: str, format: str):
 @app.post("/regenerate-glyphs/{job_id}")
 async def regenerate_glyphs(
     job_id: str, 
-    background_tasks: BackgroundTasks, 
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     chars_to_regenerate: str = Form(...)
 ):
@@ -264,41 +599,85 @@ async def regenerate_glyphs(
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(debug_dir, exist_ok=True)
     
+    try:
+        data, _, image = await ingest_upload(file)
+    except UploadRejected as e:
+        return upload_rejected_response(e)
+
     # Save the uploaded file with a different name to avoid conflicts
-    file_path = job_dir / f"regenerate_{file.filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    file_path = job_dir / f"regenerate_{os.path.basename(file.filename or 'image')}"
     
     # Parse the characters to regenerate
     chars_list = chars_to_regenerate.split(',')
     
-    # Process the regeneration in the background
-    background_tasks.add_task(
-        process_glyph_regeneration,
-        str(file_path),
-        str(output_dir),
-        str(debug_dir),
-        job_id,
-        chars_list
-    )
+    await run_in_threadpool(start_regeneration, job_id)
+
+    # Queue the regeneration for a worker process
+    try:
+        submit_job(
+            job_id,
+            process_glyph_regeneration,
+            str(file_path),
+            str(output_dir),
+            str(debug_dir),
+            job_id,
+            chars_list,
+            image
+        )
+    except QueueFull as e:
+        await run_in_threadpool(fail_queued_regeneration, job_id, e)
+        return queue_full_response(e)
+    background_tasks.add_task(write_upload, file_path, data)
     
     return {"job_id": job_id, "message": "Glyph regeneration started"}
 
-def process_font(file_path, output_dir, debug_dir, job_id):
+def process_font(file_path, output_dir, debug_dir, job_id, cache_key=None, image=None):
+    """
+    Run the font pipeline for one image. With cache_key, the finished result
+    is added to the result cache. A decoded image, if given, is used instead
+    of reading file_path.
+    """
     try:
+        # Retention may have expired the debug dir of a job being resumed
+        os.makedirs(debug_dir, exist_ok=True)
+        # Every stage saves a checkpoint; stages finished by an earlier attempt are skipped
+        pending = pending_stages(output_dir)
+        if pending != PIPELINE_STAGES:
+            print(f"Resuming job {job_id} at stages {pending}")
+
         # Step 1: Load and threshold image
-        bitmap = load_and_threshold_image(file_path, debug_dir=debug_dir)
-        print("bitmap loaded")
+        if "bitmap" in pending:
+            bitmap = load_and_threshold_image(file_path if image is None else image, debug_dir=debug_dir)
+            save_checkpoint(output_dir, "bitmap", bitmap)
+            print("bitmap loaded")
         # Step 2: Trace bitmap to SVG paths
-        paths_data, filtered_bboxes = trace_bitmap_to_svg_paths(bitmap, debug_dir=debug_dir)
-        print("paths_data, filtered_bboxes loaded")
+        if "traced" in pending:
+            if "bitmap" not in pending:
+                bitmap = load_checkpoint(output_dir, "bitmap")
+            paths_data, filtered_bboxes = trace_bitmap_to_svg_paths(bitmap, debug_dir=debug_dir)
+            # Outlines are checkpointed as SVG path data; the later stages accept either
+            save_checkpoint(output_dir, "traced", [[outline.to_svg_path() for outline in paths_data], filtered_bboxes])
+            print("paths_data, filtered_bboxes loaded")
         # Step 3: Merge glyph components
-        merged_paths, merged_bboxes = merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=debug_dir, debug=True)
-        print("merged_paths, merged_bboxes loaded")
+        if "merged" in pending:
+            if "traced" not in pending:
+                paths_data, filtered_bboxes = load_checkpoint(output_dir, "traced")
+                filtered_bboxes = [tuple(bbox) for bbox in filtered_bboxes]
+            merged_paths, merged_bboxes = merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=debug_dir, debug=True)
+            save_checkpoint(output_dir, "merged", [[outline.to_svg_path() for outline in merged_paths], merged_bboxes])
+            print("merged_paths, merged_bboxes loaded")
+            print(f"Merged {len(paths_data)} paths into {len(merged_paths)} glyphs")
+        update_job(job_id, info_message="Glyphs traced")
         # Align & scale glyphs
-        transformed_bboxes, transformed_paths, ref_lines, scale = normalize_glyph_heights(merged_bboxes, merged_paths, output_dir, debug_dir=debug_dir)
-
-        print(f"Merged {len(paths_data)} paths into {len(merged_paths)} glyphs")
+        if "normalized" in pending:
+            if "merged" not in pending:
+                merged_paths, merged_bboxes = load_checkpoint(output_dir, "merged")
+                merged_bboxes = [tuple(bbox) for bbox in merged_bboxes]
+            transformed_bboxes, transformed_paths, ref_lines, scale = normalize_glyph_heights(merged_bboxes, merged_paths, output_dir, debug_dir=debug_dir)
+            save_checkpoint(output_dir, "normalized", [transformed_bboxes, transformed_paths, ref_lines, scale])
+        else:
+            transformed_bboxes, transformed_paths, ref_lines, scale = load_checkpoint(output_dir, "normalized")
+            transformed_bboxes = [tuple(bbox) for bbox in transformed_bboxes]
 
         print(f"ref_lines: {ref_lines}")
         print(f"scale: {scale}")
@@ -310,16 +689,22 @@ def process_font(file_path, output_dir, debug_dir, job_id):
             json.dump(ref_lines, f)
 
         print("save is done")
-        # Step 4: Create font from aligned glyphs
-        create_font_from_glyphs(transformed_paths, transformed_bboxes, output_dir=output_dir, debug_dir=debug_dir)
+        # Step 4: Create font from aligned glyphs (OCR is skipped when its char map was checkpointed)
+        create_font_from_glyphs(transformed_paths, transformed_bboxes, output_dir=output_dir, debug_dir=debug_dir,
+                                progress=job_progress(job_id), char_map=load_checkpoint(output_dir, "char_map"))
+        update_job(job_id, status="completed", info_message="Font generated")
+        if cache_key is not None:
+            job = get_job(job_id)
+            artifacts = [name for name in job["artifacts"] if name not in ("base-image", "better-prompt")]
+            result_cache.store_result(cache_key, output_dir, artifacts, job["on_demand"])
     except Exception as e:
+        update_job(job_id, status="failed", info_message="Font generation failed", error=str(e))
         print(f"Error processing font: {e}")
         # You could log this error or create an error file in the output directory
 
 @app.post("/regenerate-missing-glyphs/{job_id}")
 async def regenerate_missing_glyphs(
     job_id: str,
-    background_tasks: BackgroundTasks,
     chars_to_regenerate: str = Form(None) 
 ):
     """
@@ -336,10 +721,6 @@ async def regenerate_missing_glyphs(
     if not job_dir.exists() or not output_dir.exists():
         return {"error": "Job not found"}
     
-    # Mark regeneration as started
-    with open(os.path.join(output_dir, "regen_status.json"), "w") as fh:
-        json.dump({"status": "started", "timestamp": str(datetime.datetime.now())}, fh)
-
     # Get base image path
     base_image_path = job_dir / "base_image.png"
     if not base_image_path.exists():
@@ -354,22 +735,70 @@ async def regenerate_missing_glyphs(
     else:
         return {"error": "No missing glyphs found for this font"}
     
-    # Start regeneration in background
-    background_tasks.add_task(
-        process_missing_glyph_regeneration,
-        str(base_image_path),
-        str(output_dir),
-        str(debug_dir),
-        job_id,
-        chars_list
-    )
+    # Mark regeneration as started
+    await run_in_threadpool(start_regeneration, job_id, str(output_dir))
+
+    # Queue the regeneration for a worker process
+    try:
+        submit_job(
+            job_id,
+            process_missing_glyph_regeneration,
+            str(base_image_path),
+            str(output_dir),
+            str(debug_dir),
+            job_id,
+            chars_list
+        )
+    except QueueFull as e:
+        await run_in_threadpool(fail_queued_regeneration, job_id, e, str(output_dir))
+        return queue_full_response(e)
     
     return {"job_id": job_id, "message": f"Missing glyph regeneration started for: {', '.join(chars_list)}"}
 
-def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_to_regenerate):
+def ensure_job_recorded(job_id):
+    """Copy the on-disk state of a job from before the job store into it, so it keeps its artifacts."""
+    if get_job(job_id) is not None:
+        return
+    legacy = legacy_font_status(job_id)
+    update_job(job_id, artifacts=legacy["available_formats"], status=legacy["status"],
+               info_message=legacy["info-message"])
+
+def start_regeneration(job_id, output_dir=None):
+    """Record a regeneration as started in the job store, and in regen_status.json when output_dir is given."""
+    if output_dir is not None:
+        write_json_atomic(os.path.join(output_dir, "regen_status.json"),
+                          {"status": "started", "timestamp": str(datetime.datetime.now())})
+    ensure_job_recorded(job_id)
+    update_job(job_id, status="processing", regeneration_status="in_progress", info_message="Regeneration in progress")
+
+def fail_queued_regeneration(job_id, error, output_dir=None):
+    """Record a regeneration that could not be queued; the counterpart of start_regeneration."""
+    if output_dir is not None:
+        write_json_atomic(os.path.join(output_dir, "regen_status.json"),
+                          {"status": "failed", "error": str(error), "timestamp": str(datetime.datetime.now())})
+    update_job(job_id, status="failed", regeneration_status="failed", info_message="Server busy", error=str(error))
+
+def mark_regeneration_done(output_dir, job_id, error=None):
+    timestamp = str(datetime.datetime.now())
+    if error is None:
+        write_json_atomic(os.path.join(output_dir, "regen_status.json"), {"status": "completed", "timestamp": timestamp})
+        update_job(job_id, status="completed", regeneration_status="completed", regeneration_time=timestamp,
+                   info_message="Regeneration completed")
+    else:
+        write_json_atomic(os.path.join(output_dir, "regen_status.json"),
+                          {"status": "failed", "error": str(error), "timestamp": timestamp})
+        update_job(job_id, status="failed", regeneration_status="failed", regeneration_time=timestamp,
+                   info_message="Regeneration failed", error=str(error))
+
+def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_to_regenerate, image=None):
     try:
+        # Retention may have expired the debug dir of an older job
+        os.makedirs(debug_dir, exist_ok=True)
+        # Files linked from the result cache are rewritten below; give this job its own copies
+        result_cache.unshare_tree(output_dir)
+
         # Step 1: Load and threshold image
-        bitmap = load_and_threshold_image(file_path, debug_dir=debug_dir)
+        bitmap = load_and_threshold_image(file_path if image is None else image, debug_dir=debug_dir)
         
         # Step 2: Trace bitmap to SVG paths
         paths_data, filtered_bboxes = trace_bitmap_to_svg_paths(bitmap, debug_dir=debug_dir)
@@ -379,6 +808,7 @@ def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_t
         
         # Step 4: Align glyphs
         transformed_bboxes, transformed_paths, ref_lines, scale = normalize_glyph_heights(merged_bboxes, merged_paths, output_dir, debug_dir=debug_dir, cluster_centers_passed=True)
+        update_job(job_id, info_message="Replacement glyphs traced")
 
         
         # Step 5: Create a temporary directory for the new glyphs
@@ -395,7 +825,7 @@ def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_t
         )
         
         # Step 7: Merge into the main font + redo tracking / kerning
-        drop_in_replacement(output_dir, repl_font_path, char_map)
+        drop_in_replacement(output_dir, repl_font_path, char_map, progress=job_progress(job_id))
         
         # Step 8: Book-keeping
         with open(os.path.join(output_dir, "regenerated_glyphs.json"), "w") as fh:
@@ -405,13 +835,11 @@ def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_t
             }, fh)
         
         # Mark regeneration as complete
-        with open(os.path.join(output_dir, "regen_status.json"), "w") as fh:
-            json.dump({"status": "completed", "timestamp": str(datetime.datetime.now())}, fh)
+        mark_regeneration_done(output_dir, job_id)
             
     except Exception as e:
         # Mark regeneration as failed
-        with open(os.path.join(output_dir, "regen_status.json"), "w") as fh:
-            json.dump({"status": "failed", "error": str(e), "timestamp": str(datetime.datetime.now())}, fh)
+        mark_regeneration_done(output_dir, job_id, error=e)
             
         print(f"Error during glyph regeneration: {e}")
         import traceback
@@ -424,7 +852,6 @@ def process_glyph_regeneration(file_path, output_dir, debug_dir, job_id, chars_t
 @app.post("/regenerate-missing-glyphs/{job_id}")
 async def regenerate_missing_glyphs(
     job_id: str,
-    background_tasks: BackgroundTasks,
     chars_to_regenerate: str = Form(None)  # Optional - can use missing_glyphs.json if not provided
 ):
     """
@@ -457,32 +884,47 @@ async def regenerate_missing_glyphs(
         with open(missing_glyphs_path, "r") as f:
             chars_list = json.load(f)
     
-    # Start regeneration in background
-    background_tasks.add_task(
-        process_missing_glyph_regeneration,
-        str(base_image_path),
-        str(output_dir),
-        str(debug_dir),
-        job_id,
-        chars_list
-    )
+    # Mark regeneration as started
+    await run_in_threadpool(start_regeneration, job_id, str(output_dir))
+
+    # Queue the regeneration for a worker process
+    try:
+        submit_job(
+            job_id,
+            process_missing_glyph_regeneration,
+            str(base_image_path),
+            str(output_dir),
+            str(debug_dir),
+            job_id,
+            chars_list
+        )
+    except QueueFull as e:
+        await run_in_threadpool(fail_queued_regeneration, job_id, e, str(output_dir))
+        return queue_full_response(e)
     
     return {"job_id": job_id, "message": f"Missing glyph regeneration started for: {', '.join(chars_list)}"}
 
 def process_missing_glyph_regeneration(base_image_path, output_dir, debug_dir, job_id, chars_to_regenerate):
     try:
+        # Retention may have expired the debug dir of an older job
+        os.makedirs(debug_dir, exist_ok=True)
+        # Files linked from the result cache are rewritten below; give this job its own copies
+        result_cache.unshare_tree(output_dir)
+
         # Generate new image with missing glyphs
         regen_image_path = generate_missing_glyphs_image(
             chars_to_regenerate,
             job_id,
             base_image_path
         )
+        update_job(job_id, info_message="Regeneration image generated")
         
         # Process the new image
         bitmap = load_and_threshold_image(regen_image_path, debug_dir=debug_dir)
         paths_data, filtered_bboxes = trace_bitmap_to_svg_paths(bitmap, debug_dir=debug_dir)
         merged_paths, merged_bboxes = merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=debug_dir, debug=True)
         transformed_bboxes, transformed_paths, ref_lines, scale = normalize_glyph_heights(merged_bboxes, merged_paths, output_dir, debug_dir=debug_dir, cluster_centers_passed=True)
+        update_job(job_id, info_message="Replacement glyphs traced")
 
         
         # Create temporary directory for the new glyphs
@@ -499,7 +941,7 @@ def process_missing_glyph_regeneration(base_image_path, output_dir, debug_dir, j
         )
         
         # Merge into main font
-        drop_in_replacement(output_dir, repl_font_path, char_map)
+        drop_in_replacement(output_dir, repl_font_path, char_map, progress=job_progress(job_id))
         
         # Update status
         with open(os.path.join(output_dir, "regenerated_glyphs.json"), "w") as fh:
@@ -508,8 +950,10 @@ def process_missing_glyph_regeneration(base_image_path, output_dir, debug_dir, j
                 "regeneration_timestamp": str(datetime.datetime.now()),
                 "status": "completed"
             }, fh)
+        mark_regeneration_done(output_dir, job_id)
             
     except Exception as e:
+        mark_regeneration_done(output_dir, job_id, error=e)
         print(f"Error during missing glyph regeneration: {e}")
         import traceback
         traceback.print_exc()
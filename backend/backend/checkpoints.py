@@ -0,0 +1,61 @@
+import datetime
+import json
+import os
+import numpy as np
+from utils import write_json_atomic
+
+# Stages of process_font whose output is kept so a failed or interrupted job
+# can pick up where it stopped. The manifest lists the stages that finished.
+PIPELINE_STAGES = ["bitmap", "traced", "merged", "normalized", "char_map"]
+CHECKPOINT_DIR_NAME = "checkpoints"
+MANIFEST_NAME = "manifest.json"
+
+def checkpoint_dir(output_dir):
+    return os.path.join(output_dir, CHECKPOINT_DIR_NAME)
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(checkpoint_dir(output_dir), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"stages": {}}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def save_checkpoint(output_dir, stage, value):
+    """
+    Persist the output of a stage: NumPy arrays as compressed .npz, anything
+    else as JSON. The manifest is only updated once the file is complete.
+    """
+    directory = checkpoint_dir(output_dir)
+    os.makedirs(directory, exist_ok=True)
+    if isinstance(value, np.ndarray):
+        filename = f"{stage}.npz"
+        tmp_path = os.path.join(directory, f"{stage}.tmp.npz")
+        np.savez_compressed(tmp_path, value=value)
+        os.replace(tmp_path, os.path.join(directory, filename))
+    else:
+        filename = f"{stage}.json"
+        # NumPy scalars coming out of the normalization step are not JSON types
+        data = json.loads(json.dumps(value, default=lambda item: item.tolist()))
+        write_json_atomic(os.path.join(directory, filename), data)
+
+    manifest = load_manifest(output_dir)
+    manifest["stages"][stage] = {"file": filename, "completed_at": str(datetime.datetime.now())}
+    write_json_atomic(os.path.join(directory, MANIFEST_NAME), manifest)
+
+def load_checkpoint(output_dir, stage):
+    """Output of a finished stage, or None if the stage has no checkpoint."""
+    entry = load_manifest(output_dir)["stages"].get(stage)
+    if entry is None:
+        return None
+    path = os.path.join(checkpoint_dir(output_dir), entry["file"])
+    if entry["file"].endswith(".npz"):
+        with np.load(path) as archive:
+            return archive["value"]
+    with open(path, "r") as f:
+        return json.load(f)
+
+def pending_stages(output_dir):
+    """Stages after the last one with a checkpoint, in pipeline order."""
+    finished = load_manifest(output_dir)["stages"]
+    last = max((PIPELINE_STAGES.index(stage) for stage in finished if stage in PIPELINE_STAGES), default=-1)
+    return PIPELINE_STAGES[last + 1:]
@@ -1,48 +1,73 @@
 import os
 import json
 import fontforge
-from lxml import etree
-from ocr_utils import extract_chars
-from adjust_kerning import optimize_kerning
+from ocr_utils import extract_chars, load_glyph_mapping
+from adjust_kerning import optimize_kerning, BIGRAM_COVERAGE
 from adjust_weight import create_all_variants
 from adjust_tracking import tracking_font
+from checkpoints import save_checkpoint
+from glyph_outline import as_outline, as_svg_path
+
+def create_font_from_glyphs(aligned_paths, aligned_bboxes, output_dir, debug_dir=None, progress=None, char_map=None):
+    """
+    Build MyFont.otf and its weight variants from the normalized glyph paths
+    (SVG path data as normalize_glyph_heights returns it, or GlyphOutlines).
+    The SVG files written on the way are for OCR and debugging; glyphs are
+    drawn from the paths in memory, parsed once with as_outline.
+    progress(info_message, artifacts) is called as stages finish, if given.
+    A char_map from an earlier attempt skips OCR; the glyph_mapping.txt of
+    that attempt is still in output_dir.
+    """
+    if progress is None:
+        progress = lambda info_message, artifacts=(), on_demand=(): None
+
+    path_data = [as_svg_path(aligned_path, precision=2) for aligned_path in aligned_paths]
 
-def create_font_from_glyphs(aligned_paths, aligned_bboxes, output_dir, debug_dir=None):
     # Save merged SVG
     svg_content = '<svg xmlns="http://www.w3.org/2000/svg">\n'
-    for aligned_path in aligned_paths:
-        svg_content += f'<path d="{aligned_path}" fill="black" fill-rule="evenodd" />\n'
+    for path_d in path_data:
+        svg_content += f'<path d="{path_d}" fill="black" fill-rule="evenodd" />\n'
     svg_content += '</svg>'
 
     svg_path = os.path.join(output_dir, "font.svg")
     with open(svg_path, "w") as f:
         f.write(svg_content)
 
-    # Extract glyphs
+    # One SVG file per glyph for OCR
     glyphs_dir = os.path.join(output_dir, "glyphs")
     os.makedirs(glyphs_dir, exist_ok=True)
 
-    tree = etree.fromstring(svg_content.encode())
-    paths = tree.findall(".//{http://www.w3.org/2000/svg}path")
-
-    for i, path in enumerate(paths):
+    for i, path_d in enumerate(path_data):
         glyph_svg = f"""<?xml version="1.0" standalone="no"?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" 
   "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
 <svg xmlns="http://www.w3.org/2000/svg" version="1.1">
-<path d="{path.get('d')}" fill="black" fill-rule="evenodd" />
+<path d="{path_d}" fill="black" fill-rule="evenodd" />
 </svg>"""
         glyph_path = os.path.join(glyphs_dir, f"glyph_{i}.svg")
         with open(glyph_path, "w") as f:
             f.write(glyph_svg)
 
     # Use OCR to identify characters
-    map_clusters_to_chars = extract_chars(glyphs_dir)
-    
-    # Use the filtered glyphs directory for font generation
-    filtered_dir = os.path.join(output_dir, "filtered_glyphs")
-    os.makedirs(filtered_dir, exist_ok=True)  # Make sure this directory exists
+    if char_map:
+        map_clusters_to_chars = char_map
+    else:
+        # The bboxes of the normalized paths are known, OCR does not re-parse the SVGs for them
+        map_clusters_to_chars = extract_chars(glyphs_dir, path_bboxes=dict(enumerate(aligned_bboxes)))
+        # An empty map means OCR failed; leave it to be retried
+        if map_clusters_to_chars:
+            save_checkpoint(output_dir, "char_map", map_clusters_to_chars)
+    if os.path.exists(os.path.join(output_dir, "grid_glyphs.png")):
+        progress("glyphs split and put into grid", ["grid-glyphs"])
     
+    # char map keys are indices among the glyphs OCR kept (strings once checkpointed)
+    glyph_mapping = load_glyph_mapping(output_dir)
+    char_outlines = {}
+    for new_idx, char in map_clusters_to_chars.items():
+        orig_idx = glyph_mapping.get(int(new_idx))
+        if orig_idx is not None and orig_idx < len(aligned_paths):
+            char_outlines[char] = aligned_paths[orig_idx]
+
     # Create font
     font = fontforge.font()
     font.familyname = "MyFont"
@@ -57,15 +82,15 @@ def create_font_from_glyphs(aligned_paths, aligned_bboxes, output_dir, debug_dir
     
     # Import glyphs and analyze bounding boxes
     char_bboxes = {}
-    for char in map_clusters_to_chars.values():
-        # Look for both upper and lower case versions
-        case_indicator = "upper" if char.isupper() else "lower"
-        svg_file = os.path.join(filtered_dir, f"{char}_{case_indicator}.svg")
-        if not os.path.exists(svg_file):
-            continue
+    for char, aligned_path in char_outlines.items():
         # Create glyph with proper Unicode code point
         glyph = font.createChar(ord(char))
-        glyph.importOutlines(svg_file)
+        outline = as_outline(aligned_path).copy()
+        # SVG y grows downwards; flip about the ascent as fontforge's SVG import does
+        outline.transform((1, 0, 0, -1, 0, font.ascent))
+        pen = glyph.glyphPen()
+        outline.draw(pen)
+        pen = None  # the pen writes the contours into the glyph when released
         glyph.correctDirection()
         glyph.removeOverlap()
         #glyph.simplify()
@@ -82,6 +107,7 @@ def create_font_from_glyphs(aligned_paths, aligned_bboxes, output_dir, debug_dir
     missing_glyphs_path = os.path.join(output_dir, "missing_glyphs.json")
     with open(missing_glyphs_path, 'w') as f:
         json.dump(missing_glyphs, f)
+    progress("Glyphs detected", ["missing-glyphs"])
 
     # Compute descender threshold
     bottoms = [bbox[1] for bbox in char_bboxes.values()]
@@ -124,13 +150,18 @@ def create_font_from_glyphs(aligned_paths, aligned_bboxes, output_dir, debug_dir
     # Adjust tracking
     font, target_spacing = tracking_font(font, map_clusters_to_chars)
     # Adjust kerning
-    optimize_kerning(font, target_spacing)
+    optimize_kerning(font, target_spacing,
+                     store_path=os.path.join(output_dir, "kerning_store.json"),
+                     fea_path=os.path.join(output_dir, "kerning.fea"),
+                     bigram_coverage=BIGRAM_COVERAGE)
 
     # Save font
     font.generate(os.path.join(output_dir, "MyFont.otf"))
     print("Font generated at", output_dir)
+    progress("Base font built")
 
     # weight variants
-    create_all_variants(os.path.join(output_dir, "MyFont.otf"), output_dir+"/fonts", bold_delta=32, light_delta=-32, regular=0)
+    create_all_variants(os.path.join(output_dir, "MyFont.otf"), output_dir+"/fonts", bold_delta=32, light_delta=-32, regular=0,
+                        progress=progress)
 
     print("Font generation completed")
\ No newline at end of file
@@ -2,13 +2,60 @@ import json
 import numpy as np
 from line_detection import segment_text_lines
 from visualization import visualize_lines
-import pandas as pd
+from glyph_outline import as_outline, svg_path_data
 from scipy.signal import find_peaks
 from scipy.stats import gaussian_kde
-import re
 import os
 import matplotlib.pyplot as plt
 
+def scale_and_shift_glyphs(outlines, scale_factors, vertical_shifts, precision=2):
+    """
+    Shift every glyph vertically, then scale it, in one pass over the stacked
+    coordinates of all glyphs. Returns the SVG paths with `precision`
+    decimals and, from the same arrays, the bbox of each path's coordinates
+    as written: (x_min, x_max, y_min, y_max), (0, 0, 0, 0) for an empty glyph.
+    """
+    if not outlines:
+        return [], []
+    counts = np.array([len(outline.points) for outline in outlines], dtype=np.intp)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    points = np.concatenate([outline.points for outline in outlines]).astype(np.float64)
+    codes = np.concatenate([outline.codes for outline in outlines])
+
+    # Per-point copies of the per-glyph scale and shift
+    glyph_of_point = np.repeat(np.arange(len(outlines)), counts)
+    points[:, 1] += np.asarray(vertical_shifts, dtype=np.float64)[glyph_of_point]
+    points *= np.asarray(scale_factors, dtype=np.float64)[glyph_of_point, None]
+
+    # Extremes per glyph; reduceat needs the empty glyphs left out
+    lows = np.zeros((len(outlines), 2))
+    highs = np.zeros((len(outlines), 2))
+    non_empty = counts > 0
+    if non_empty.any():
+        starts = offsets[:-1][non_empty]
+        lows[non_empty] = np.minimum.reduceat(points, starts, axis=0)
+        highs[non_empty] = np.maximum.reduceat(points, starts, axis=0)
+
+    paths = []
+    bboxes = []
+    for i in range(len(outlines)):
+        start, end = offsets[i], offsets[i + 1]
+        paths.append(svg_path_data(points[start:end], codes[start:end], precision))
+        if start == end:
+            bboxes.append((0, 0, 0, 0))
+        else:
+            # Rounding the extremes equals the extremes of the rounded coordinates
+            bboxes.append((round(float(lows[i, 0]), precision), round(float(highs[i, 0]), precision),
+                           round(float(lows[i, 1]), precision), round(float(highs[i, 1]), precision)))
+    return paths, bboxes
+
+def format_glyph_stats(glyph_stats, order):
+    """The statistics columns as a plain-text table, rows in the given order."""
+    names = list(glyph_stats)
+    rows = [names] + [[str(glyph_stats[name][i]) for name in names] for i in order]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(names))]
+    return "\n".join("  ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+
 def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=None, cluster_centers_passed=False):
     """
     Main normalization pipeline. Returns:
@@ -16,6 +63,7 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
     - transformed_paths: Scaled and aligned SVG paths
     - reference_lines: Dictionary of reference heights
     - scale_factor: Calculated scaling factor
+    glyph_paths may be GlyphOutlines or SVG path data.
     """
     # ====================== 1. Line Segmentation ======================
     lines = segment_text_lines(filtered_bboxes, debug_dir, threshold=0.8)
@@ -98,74 +146,62 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
     heights = [new_bboxes[i][3] - new_bboxes[i][2] for i in range(len(new_bboxes))]
     widths = [new_bboxes[i][1] - new_bboxes[i][0] for i in range(len(new_bboxes))]
     areas = [heights[i] * widths[i] for i in range(len(new_bboxes))]
-    indices = [i for i in range(len(new_bboxes))]
     topline = [new_bboxes[i][2] - bottom_baseline for i in range(len(new_bboxes))]
     
-    # Create a DataFrame with all your glyph data
-    df = pd.DataFrame({
-        "index": indices,
-        "height": heights,
-        "width": widths,
-        "area": areas,
-        "adjustment": flat_adjustments,
-        "topline": flat_topline,
-        "bottomline": flat_bottomline,
-        "calculated_height": [h + a for h, a in zip(heights, flat_adjustments)],
-        "is_descender": flat_descenders,
-        
-    })
-    
-    # Round all numeric columns to 2 decimal places
-    df = df.round(2)
+    # Per-glyph statistics, one NumPy array per column, rounded to 2 decimals
+    glyph_stats = {
+        "index": np.arange(len(new_bboxes)),
+        "height": np.round(np.asarray(heights, dtype=float), 2),
+        "width": np.round(np.asarray(widths, dtype=float), 2),
+        "area": np.round(np.asarray(areas, dtype=float), 2),
+        "adjustment": np.round(np.asarray(flat_adjustments, dtype=float), 2),
+        "topline": np.round(np.asarray(flat_topline, dtype=float), 2),
+        "bottomline": np.round(np.asarray(flat_bottomline, dtype=float), 2),
+        "calculated_height": np.round(np.add(heights, flat_adjustments, dtype=float), 2),
+        "is_descender": np.asarray(flat_descenders, dtype=bool),
+    }
     
-    # Statistical analysis with DataFrame methods
-    print(f"heights: std={df['height'].std()}, mean={df['height'].mean()}")
-    print(f"widths: std={df['width'].std()}, mean={df['width'].mean()}")
-    print(f"areas: std={df['area'].std()}, mean={df['area'].mean()}")
-    print(f"topline: std={df['topline'].std()}, mean={df['topline'].mean()}")
-    print(f"bottomline: std={df['bottomline'].std()}, mean={df['bottomline'].mean()}")
-
-    median_area = df['area'].median()
-    median_height = df['height'].median()
-    median_width = df['width'].median()
+    # Statistical analysis (sample standard deviation)
+    for name, label in [("height", "heights"), ("width", "widths"), ("area", "areas"),
+                        ("topline", "topline"), ("bottomline", "bottomline")]:
+        column = glyph_stats[name]
+        std = np.std(column, ddof=1) if len(column) > 1 else float("nan")
+        print(f"{label}: std={std}, mean={np.mean(column) if len(column) else float('nan')}")
+
+    median_area = np.median(glyph_stats["area"])
+    median_height = np.median(glyph_stats["height"])
+    median_width = np.median(glyph_stats["width"])
     
     print(f"median_area: {median_area}")
     print(f"median_height: {median_height}")
     print(f"median_width: {median_width}")
 
-    # Define outlier criteria using pandas
-    df['is_outlier'] = (
-        (df['area'] > 2.5 * median_area) | 
-        (df['height'] > 1.5 * median_height) | 
-        (df['width'] > 2 * median_width)
+    # Define outlier criteria
+    glyph_stats["is_outlier"] = (
+        (glyph_stats["area"] > 2.5 * median_area) |
+        (glyph_stats["height"] > 1.5 * median_height) |
+        (glyph_stats["width"] > 2 * median_width)
     )
     
-    df['is_punctuation'] = (
-        ((df['area'] < 0.3 * median_area) | 
-         (df['height'] < 0.3 * median_height) | 
-         (df['width'] < 0.2 * median_width)) &
-        (df['height'] <= 0.6 * median_height)
+    glyph_stats["is_punctuation"] = (
+        ((glyph_stats["area"] < 0.3 * median_area) |
+         (glyph_stats["height"] < 0.3 * median_height) |
+         (glyph_stats["width"] < 0.2 * median_width)) &
+        (glyph_stats["height"] <= 0.6 * median_height)
     )
     
     # Get indices lists if needed elsewhere
-    outlier_indices = df[df['is_outlier']].index.tolist()
-    punctuation_indices = df[df['is_punctuation']].index.tolist()
+    outlier_indices = np.flatnonzero(glyph_stats["is_outlier"]).tolist()
+    punctuation_indices = np.flatnonzero(glyph_stats["is_punctuation"]).tolist()
     
     print(f"outlier_indices: {outlier_indices}")
     print(f"punctuation_indices: {punctuation_indices}")
-    decender_indices = df[df['is_descender']].index.tolist()
+    decender_indices = np.flatnonzero(glyph_stats["is_descender"]).tolist()
     print(f"decender_indices: {decender_indices}")
 
-    # Mark outliers and punctuation in the DataFrame
-    df["is_outlier"] = False
-    df["is_punctuation"] = False
-    
-    df.loc[outlier_indices, "is_outlier"] = True
-    df.loc[punctuation_indices, "is_punctuation"] = True
-
-    # Sort the DataFrame by calculated_height
-    df = df.sort_values(by="calculated_height")
-    print(f"Sorted DataFrame: \n{df}")
+    # Print the glyphs sorted by calculated_height
+    sorted_order = np.argsort(glyph_stats["calculated_height"], kind="stable")
+    print(f"Sorted glyph statistics: \n{format_glyph_stats(glyph_stats, sorted_order)}")
 
     # ====================== 4. cluster heights ======================
     # here we will cluster the heights into 3 clusters, x height, cap height, decender heights
@@ -175,9 +211,9 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
     # important we want to keep outliers of the method as separate clusters that will be scaled linearly
 
     # Filter out outliers and punctuation for clustering
-    clustering_df = df[~(df['is_punctuation'] | df['is_outlier'])]
+    clustering_mask = ~(glyph_stats["is_punctuation"] | glyph_stats["is_outlier"])
 
-    valid_heights = clustering_df['topline'].values
+    valid_heights = glyph_stats["topline"][clustering_mask]
 
     # Generate KDE to smooth the histogram
     if len(valid_heights) > 3:  # Need sufficient data for KDE
@@ -251,13 +287,10 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
 
     
     # Assign each glyph to nearest typographic line
-    df['cluster'] = df['topline'].apply(
-        lambda h: np.argmin(np.abs([h-cluster_centers[0], h-cluster_centers[1], h-cluster_centers[2], h-cluster_centers[3]]))
-    )
-    if punctuation_indices:
-        df.loc[punctuation_indices, 'cluster'] = 3
-    if outlier_indices:
-        df.loc[outlier_indices, 'cluster'] = 4
+    line_centers = np.asarray([cluster_centers[0], cluster_centers[1], cluster_centers[2], cluster_centers[3]], dtype=float)
+    glyph_clusters = np.argmin(np.abs(glyph_stats["topline"][:, None] - line_centers[None, :]), axis=1)
+    glyph_clusters[punctuation_indices] = 3
+    glyph_clusters[outlier_indices] = 4
     cluster_mapping = {
         'x_height_cluster': 0,
         'cap_height_cluster': 1,
@@ -285,7 +318,7 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
         plt.figure(figsize=(10, 6))
         
         # Plot histogram
-        plt.hist(df['topline'], bins=100, alpha=0.5, density=True)
+        plt.hist(glyph_stats["topline"], bins=100, alpha=0.5, density=True)
         
         # Plot KDE
         if len(valid_heights) > 5:
@@ -308,20 +341,19 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
     print("================================================")
 
     # ====================== 5. scale the glyphs ======================
-    transformed_bboxes = []
-    transformed_paths = []
+    # Scale and shift are decided per glyph; the coordinates are then transformed in one batched pass
     scale_factors = []
+    vertical_shifts = []
+    target_heights = []
     for i in range(len(filtered_bboxes)):
-        # Get current bbox and path
+        # Get current bbox
         bbox = filtered_bboxes[i]
-        path = glyph_paths[i]
         
         # Get cluster assignment for this glyph
-        cluster = df.loc[i, 'cluster']
+        cluster = glyph_clusters[i]
         
         # Get target height based on cluster
         target_height = cluster_centers[min(cluster, len(cluster_centers)-1)]-flat_adjustments[i]
-        index = i
 
         
         # Calculate scaling factor - how much we need to scale to reach target height
@@ -341,53 +373,18 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
         elif target_height == cluster_centers[3]:
             vertical_shift =  - y_min + max(cluster_centers[0], cluster_centers[1], cluster_centers[2])-cluster_centers[3] # punctuation
 
-        # Transform the path using regex to modify coordinates
-        coord_re = re.compile(r'([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?),([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)')
-        
-        # Define the transform function for scaling and shifting
-        def transform_coords(match):
-            x = float(match.group(1)) 
-            y = float(match.group(2))
-            
-            # First apply vertical shift
-            y += vertical_shift
-            
-            # Then apply scaling (x and y)
-            x *= scale_factor
-            y *= scale_factor
+        scale_factors.append(scale_factor)
+        vertical_shifts.append(vertical_shift)
+        target_heights.append(target_height)
 
-            return f"{x:.2f},{y:.2f}"
-        
-        # Apply the transformation to the path
-        transformed_path = coord_re.sub(transform_coords, path)
-        
-        # Function to extract bounding box from an SVG path
-        def bbox_from_path(path_str):
-            # Extract all coordinate pairs
-            matches = coord_re.findall(path_str)
-            if not matches:
-                return (0, 0, 0, 0)
-                
-            # Parse x,y values from matches
-            coords = [(float(x), float(y)) for x, y in matches]
-            
-            # Find min/max values
-            x_values = [x for x, y in coords]
-            y_values = [y for x, y in coords]
-            
-            x_min = min(x_values)
-            x_max = max(x_values)
-            y_min = min(y_values)
-            y_max = max(y_values)
-            
-            return (x_min, x_max, y_min, y_max)
-        
-        # Verify the transformation
-        path_bbox = bbox_from_path(transformed_path)
+    outlines = [as_outline(glyph_paths[i]) for i in range(len(filtered_bboxes))]
+    transformed_paths, transformed_bboxes = scale_and_shift_glyphs(outlines, scale_factors, vertical_shifts)
 
+    for i, scale_factor in enumerate(scale_factors):
         if scale_factor > 1.5 or scale_factor < 0.6:
-            print(f"index: {index}")
-            print(f"target_height: {target_height}")
+            current_height = flat_topline[i] - flat_bottomline[i]
+            print(f"index: {i}")
+            print(f"target_height: {target_heights[i]}")
             print("================================================")
             print(f"Warning: Scale factor is too large or too small for glyph {i}")
             print(f"current_height: {current_height}")
@@ -401,12 +398,8 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
             print("================================================")
             print(f"scale_factor: {scale_factor}")
             print("================================================")
-            print(f"Path transformed_bbox: {path_bbox}")
+            print(f"Path transformed_bbox: {transformed_bboxes[i]}")
             print("================================================")
-
-        scale_factors.append(scale_factor)
-        transformed_bboxes.append(path_bbox)
-        transformed_paths.append(transformed_path)
     
     # Create reference lines dictionary to return
     reference_lines = {
@@ -419,7 +412,7 @@ def normalize_glyph_heights(filtered_bboxes, glyph_paths, output_dir, debug_dir=
     
     # Use a representative scale factor for the return value
     avg_scale = np.mean([float(scale_factors[i]) for i in range(len(new_bboxes)) 
-                         if not df.loc[i, 'is_outlier'] and not df.loc[i, 'is_punctuation']])
+                         if not glyph_stats["is_outlier"][i] and not glyph_stats["is_punctuation"][i]])
     
     print(f"avg_scale: {avg_scale}")
     print("================================================")
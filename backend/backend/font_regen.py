@@ -1,10 +1,10 @@
 import os
-import json
 import fontforge
-from adjust_kerning import optimize_kerning
+from adjust_kerning import optimize_kerning, load_kerning_store, BIGRAM_COVERAGE
 from adjust_tracking import tracking_font
 from adjust_weight import create_all_variants
 from font_generation import create_font_from_glyphs
+from utils import write_json_atomic
 from typing import Dict, List, Optional, Tuple
 import datetime
 
@@ -56,10 +56,13 @@ def drop_in_replacement(
         output_dir: str,
         replacement_font_path: str,
         char_map: dict[int, str],
+        progress=None,
 ):
     """
     Open the existing font, *remove* any glyphs that are about to be
     regenerated, merge the replacement font, then redo tracking/kerning.
+    Kerning is incremental: pairs between unchanged glyphs come from the
+    job's kerning store.
     """
     base_font_path = os.path.join(output_dir, "MyFont.otf")
     font = fontforge.open(base_font_path)
@@ -88,8 +91,16 @@ def drop_in_replacement(
                key=lambda g: g.unicode))
     }
 
-    font, target = tracking_font(font, full_map)
-    optimize_kerning(font, target)
+    # Keep the spacing the job was built with, so untouched glyphs keep their
+    # outlines and only pairs involving the new glyphs need fresh kerning.
+    store_path = os.path.join(output_dir, "kerning_store.json")
+    store = load_kerning_store(store_path)
+    previous_spacing = store.get("target_spacing") if store else None
+
+    font, target = tracking_font(font, full_map, target_spacing=previous_spacing)
+    optimize_kerning(font, target, store_path=store_path,
+                     fea_path=os.path.join(output_dir, "kerning.fea"),
+                     bigram_coverage=BIGRAM_COVERAGE)
 
     present_chars = {chr(g.unicode)                
                      for g in font.glyphs()
@@ -99,7 +110,8 @@ def drop_in_replacement(
     font.generate(os.path.join(output_dir, "MyFont.ttf"))
     font.generate(os.path.join(output_dir, "MyFont.otf"))
     
-    create_all_variants(os.path.join(output_dir, "MyFont.otf"), output_dir+"/fonts", bold_delta=32, light_delta=-32, regular=0)
+    create_all_variants(os.path.join(output_dir, "MyFont.otf"), output_dir+"/fonts", bold_delta=32, light_delta=-32, regular=0,
+                        progress=progress)
 
     # ───────────────────────────────────────────────────────────────
     # 5.  KEEP  missing_glyphs.json  IN SYNC
@@ -108,16 +120,11 @@ def drop_in_replacement(
     missing_glyphs = [c for c in standard_chars if c not in present_chars]
     missing_path   = os.path.join(output_dir, "missing_glyphs.json")
 
-    if missing_glyphs:
-        with open(missing_path, "w") as fh:
-            json.dump(missing_glyphs, fh)
-    else:                            # everything present → remove the file
-        with open(missing_path, "w") as fh:
-            json.dump([], fh)
+    write_json_atomic(missing_path, missing_glyphs)
             
     # Write status file to indicate regeneration is complete
-    with open(os.path.join(output_dir, "regen_status.json"), "w") as fh:
-        json.dump({"status": "completed", "timestamp": str(datetime.datetime.now())}, fh)
+    write_json_atomic(os.path.join(output_dir, "regen_status.json"),
+                      {"status": "completed", "timestamp": str(datetime.datetime.now())})
 
 
 # ─────────────────────────────────────────────────────────────────────────────
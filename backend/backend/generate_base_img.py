@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 load_dotenv()  # Add this at the top of generate_base_img.py
 
 def generate_base_image(prompt):
+    """Generate a base glyph sheet with gpt-image-1 and return the PNG bytes."""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"
@@ -29,15 +30,12 @@ def generate_base_image(prompt):
     
     if response.status_code == 200:
         data = response.json()
-        image_data = base64.b64decode(data['data'][0]['b64_json'])
-        with open('typeface_base.png', 'wb') as f:
-            f.write(image_data)
-        return 'typeface_base.png'
+        return base64.b64decode(data['data'][0]['b64_json'])
     else:
         raise Exception(f"Image generation failed: {response.text}")
 
 def generate_base_image_replicate(prompt):
-    """Alternative version using Replicate's bytedance/seedream-3 model"""
+    """Alternative version using Replicate's bytedance/seedream-3 model; returns the image bytes"""
     try:
         input_data = {
             "prompt": prompt
@@ -48,11 +46,8 @@ def generate_base_image_replicate(prompt):
             input=input_data
         )
         
-        # Save the output to the same filename as the original function
-        with open('typeface_base.png', 'wb') as file:
-            file.write(output.read())
-        
-        return 'typeface_base.png'
+        # Hand the bytes to the caller; the job decides where (and whether) to store them
+        return output.read()
         
     except Exception as e:
         raise Exception(f"Replicate image generation failed: {str(e)}")
@@ -0,0 +1,165 @@
+import re
+import numpy as np
+
+# Segment codes, one per point. A cubic curve is three CURVE points
+# (two controls, then the end point); every contour is closed.
+MOVE, LINE, CURVE = 0, 1, 2
+
+SVG_TOKEN_RE = re.compile(r"[MLCZ]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+SVG_COMMAND_POINTS = {"M": (MOVE, 1), "L": (LINE, 1), "C": (CURVE, 3)}
+
+class GlyphOutline:
+    """
+    Contours of one glyph as a float32 (N, 2) point array plus one segment
+    code per point. Produced by the tracer, transformed in place between
+    stages, and turned into SVG path data or fontforge pen calls only where
+    files or fonts are written.
+    """
+    __slots__ = ("points", "codes", "_bbox")
+
+    def __init__(self, points, codes):
+        self.points = np.ascontiguousarray(points, dtype=np.float32).reshape(-1, 2)
+        self.codes = np.ascontiguousarray(codes, dtype=np.uint8)
+        self._bbox = None
+
+    @classmethod
+    def from_potrace(cls, curves, x_offset=0, y_offset=0):
+        """Outline of potrace curves traced from a crop whose top left is at the offset."""
+        points, codes = [], []
+        for curve in curves:
+            points.append(curve.start_point)
+            codes.append(MOVE)
+            for segment in curve:
+                if segment.is_corner:
+                    points += [segment.c, segment.end_point]
+                    codes += [LINE, LINE]
+                else:
+                    points += [segment.c1, segment.c2, segment.end_point]
+                    codes += [CURVE, CURVE, CURVE]
+        outline = cls(points, codes)
+        outline.points += (x_offset, y_offset)
+        return outline
+
+    @classmethod
+    def from_svg_path(cls, path_d):
+        """Parse absolute M/L/C/Z path data, as written by to_svg_path."""
+        points, codes = [], []
+        tokens = SVG_TOKEN_RE.findall(path_d)
+        i = 0
+        while i < len(tokens):
+            command = tokens[i]
+            i += 1
+            if command == "Z":
+                continue
+            if command not in SVG_COMMAND_POINTS:
+                raise ValueError(f"Unsupported path data near {command!r}")
+            code, count = SVG_COMMAND_POINTS[command]
+            # Implicit repeats ("L1,2 3,4") continue the last command
+            while i < len(tokens) and tokens[i] not in "MLCZ":
+                for _ in range(count):
+                    points.append((float(tokens[i]), float(tokens[i + 1])))
+                    codes.append(CURVE if code == CURVE else LINE)
+                    i += 2
+                if code == MOVE:
+                    codes[-1] = MOVE
+                    code, count = LINE, 1
+        return cls(points, codes)
+
+    @classmethod
+    def concat(cls, outlines):
+        """One outline holding the contours of all outlines, in order."""
+        outlines = list(outlines)
+        if not outlines:
+            return cls(np.empty((0, 2), dtype=np.float32), np.empty(0, dtype=np.uint8))
+        return cls(np.concatenate([outline.points for outline in outlines]),
+                   np.concatenate([outline.codes for outline in outlines]))
+
+    def copy(self):
+        outline = GlyphOutline(self.points.copy(), self.codes)
+        outline._bbox = self._bbox
+        return outline
+
+    def transform(self, matrix):
+        """
+        Apply an affine matrix (xx, xy, yx, yy, dx, dy), the same convention
+        as fontforge's psMat, to all points in place.
+        """
+        xx, xy, yx, yy, dx, dy = matrix
+        linear = np.array([[xx, xy], [yx, yy]], dtype=np.float32)
+        self.points[:] = self.points @ linear + np.array([dx, dy], dtype=np.float32)
+        self._bbox = None
+        return self
+
+    @property
+    def bbox(self):
+        """(x_min, x_max, y_min, y_max) over all points, (0, 0, 0, 0) when empty."""
+        if self._bbox is None:
+            if len(self.points) == 0:
+                self._bbox = (0, 0, 0, 0)
+            else:
+                low, high = self.points.min(axis=0), self.points.max(axis=0)
+                self._bbox = (float(low[0]), float(high[0]), float(low[1]), float(high[1]))
+        return self._bbox
+
+    def contours(self):
+        """(start, end) point index ranges of the contours."""
+        starts = np.flatnonzero(self.codes == MOVE).tolist()
+        return list(zip(starts, starts[1:] + [len(self.codes)]))
+
+    def to_svg_path(self, precision=None):
+        """SVG path data; coordinates with `precision` decimals, or shortest round-trip form."""
+        return svg_path_data(self.points, self.codes, precision)
+
+    def draw(self, pen):
+        """Replay the contours on a fontforge glyph pen (or any pen with the same calls)."""
+        points = self.points.tolist()
+        for start, end in self.contours():
+            pen.moveTo(tuple(points[start]))
+            i = start + 1
+            while i < end:
+                if self.codes[i] == CURVE:
+                    pen.curveTo(tuple(points[i]), tuple(points[i + 1]), tuple(points[i + 2]))
+                    i += 3
+                else:
+                    pen.lineTo(tuple(points[i]))
+                    i += 1
+            pen.closePath()
+
+def svg_path_data(points, codes, precision=None):
+    """
+    SVG path data for a point array and its segment codes. Also used on
+    arrays that never become a GlyphOutline, e.g. batched float64 results.
+    """
+    if precision is None:
+        values = [np.format_float_positional(value, trim="-") for value in points.ravel()]
+    else:
+        values = [f"{value:.{precision}f}" for value in points.ravel().tolist()]
+    coords = [f"{x},{y}" for x, y in zip(values[0::2], values[1::2])]
+    codes = codes.tolist()
+
+    parts = []
+    starts = [i for i, code in enumerate(codes) if code == MOVE]
+    for start, end in zip(starts, starts[1:] + [len(codes)]):
+        path_d = f"M{coords[start]} "
+        i = start + 1
+        while i < end:
+            if codes[i] == CURVE:
+                path_d += f"C{coords[i]} {coords[i + 1]} {coords[i + 2]} "
+                i += 3
+            else:
+                path_d += f"L{coords[i]} "
+                i += 1
+        parts.append(path_d + "Z")
+    return " ".join(parts)
+
+def as_outline(path):
+    """Accept an outline or SVG path data (e.g. from a checkpoint)."""
+    if isinstance(path, GlyphOutline):
+        return path
+    return GlyphOutline.from_svg_path(path)
+
+def as_svg_path(path, precision=None):
+    """SVG path data of an outline, or the path data itself when given as text."""
+    if isinstance(path, GlyphOutline):
+        return path.to_svg_path(precision)
+    return path
@@ -1,7 +1,14 @@
 import os
+import cv2
+import numpy as np
 
 from visualization import visualize_merges, visualize_merged_bboxes
 from line_detection import segment_text_lines
+from utils import filter_large_bboxes
+from glyph_outline import GlyphOutline, as_outline
+
+# Ink regions up to this many pixels are specks, as potrace's default turdsize
+SPECKLE_AREA = 2
 
 def is_partially_contained(bbox_inner, bbox_outer, threshold=0.6):
     """
@@ -33,10 +40,47 @@ def is_partially_contained(bbox_inner, bbox_outer, threshold=0.6):
     
     return overlap_ratio >= threshold
 
+def segment_bitmap(bitmap, debug_dir=None, debug=False):
+    """
+    Split a thresholded sheet into glyphs on the raster: connected ink
+    regions, grouped with the same rules as traced contours.
+
+    Returns:
+        (labels, groups, bboxes): the component label image, the labels of
+        each glyph's components in reading order, and the glyph bboxes
+        (x_min, x_max, y_min, y_max) in sheet pixels
+    """
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(bitmap.astype(np.uint8), connectivity=8)
+    component_labels = []
+    component_bboxes = []
+    for label in range(1, count):  # label 0 is the background
+        x, y, width, height, area = (int(value) for value in stats[label])
+        bbox = (float(x), float(x + width), float(y), float(y + height))
+        if area <= SPECKLE_AREA or not filter_large_bboxes([bbox]):
+            continue
+        component_labels.append(label)
+        component_bboxes.append(bbox)
+
+    groups, bboxes = group_glyph_components(component_bboxes, debug_dir=debug_dir, debug=debug)
+    groups = [[component_labels[i] for i in group] for group in groups]
+    return labels, groups, bboxes
+
 def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
-    bbox_to_path = {i: paths_data[i] for i in range(len(paths_data))}
+    """Merge outlines (GlyphOutline or SVG path data) into one GlyphOutline per glyph."""
+    groups, final_bboxes = group_glyph_components(filtered_bboxes, debug_dir=debug_dir, debug=debug)
+    final_paths = [GlyphOutline.concat(as_outline(paths_data[i]) for i in group) for group in groups]
+    return final_paths, final_bboxes
+
+def group_glyph_components(filtered_bboxes, debug_dir=None, debug=False):
+    """
+    Group components (contours or connected ink regions) into glyphs with the
+    containment and dot/accent rules, in reading order.
+
+    Returns:
+        (groups, bboxes): lists of component indices per glyph, and the glyph bboxes
+    """
     processed = set()
-    merged_paths = []
+    merged_groups = []
     merged_bboxes = []
     merge_details = []
 
@@ -45,7 +89,7 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
         if i in processed:
             continue
         current_bbox = filtered_bboxes[i]
-        current_glyph_path = bbox_to_path[i]
+        current_group = [i]
         components_to_merge = []
 
         for j in range(len(filtered_bboxes)):
@@ -82,7 +126,7 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
 
         # Merge contained components
         for j in components_to_merge:
-            current_glyph_path += " " + bbox_to_path[j]
+            current_group.append(j)
             processed.add(j)
             current_bbox = (
                 min(current_bbox[0], filtered_bboxes[j][0]),
@@ -91,7 +135,7 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
                 max(current_bbox[3], filtered_bboxes[j][3])
             )
 
-        merged_paths.append(current_glyph_path)
+        merged_groups.append(current_group)
         merged_bboxes.append(current_bbox)
         processed.add(i)
 
@@ -143,7 +187,7 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
 
         if best_base is not None:
             # Merge small glyph with base glyph
-            merged_paths[best_base] += " " + merged_paths[small_idx]
+            merged_groups[best_base] += merged_groups[small_idx]
             merged_bboxes[best_base] = (
                 min(merged_bboxes[best_base][0], small_bbox[0]),
                 max(merged_bboxes[best_base][1], small_bbox[1]),
@@ -154,8 +198,8 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
             if debug:
                 print(f"Merged small glyph {small_idx} into base glyph {best_base}")
 
-    # Remove merged small glyphs from merged_paths and merged_bboxes
-    merged_paths = [p for i, p in enumerate(merged_paths) if i not in merged_small]
+    # Remove merged small glyphs from merged_groups and merged_bboxes
+    merged_groups = [g for i, g in enumerate(merged_groups) if i not in merged_small]
     merged_bboxes = [b for i, b in enumerate(merged_bboxes) if i not in merged_small]
 
     # After proximity-based merging
@@ -165,13 +209,13 @@ def merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=None, debug=False):
 
     # Flatten the lines to get the correct order
     ordered_indices = [i for line in lines for i in line]
-    final_paths = [merged_paths[i] for i in ordered_indices]
+    final_groups = [merged_groups[i] for i in ordered_indices]
     final_bboxes = [merged_bboxes[i] for i in ordered_indices]
 
     if debug:
-        print(f"Final merged glyph count: {len(final_paths)}")
+        print(f"Final merged glyph count: {len(final_groups)}")
         if debug_dir:
             visualize_merges(filtered_bboxes, merge_details, os.path.join(debug_dir, "merge_visualization.png"))
             visualize_merged_bboxes(final_bboxes, os.path.join(debug_dir, "merged_bboxes.png"))
     
-    return final_paths, final_bboxes
\ No newline at end of file
+    return final_groups, final_bboxes
\ No newline at end of file
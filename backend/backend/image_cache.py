@@ -0,0 +1,107 @@
+import fcntl
+import hashlib
+import os
+import re
+import time
+from utils import write_file_atomic
+
+# Base images generated from prompts, keyed by normalized prompt + model.
+# Identical prompts arriving together (even in different worker processes)
+# share one generation: the first takes a file lock per key, the rest wait
+# on it and then read the stored image.
+PROMPT_IMAGE_CACHE_DIR = os.environ.get("PROMPT_IMAGE_CACHE_DIR", "cache/prompt_images")
+PROMPT_IMAGE_CACHE_TTL = int(os.environ.get("PROMPT_IMAGE_CACHE_TTL", str(7 * 24 * 3600)))
+PROMPT_IMAGE_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+BASE_IMAGE_MODEL = "bytedance/seedream-3"
+
+def normalize_prompt(prompt):
+    """Case and whitespace differences do not change the generated image."""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+def prompt_cache_key(prompt, model):
+    return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+def replicate_generator(prompt):
+    """Default generator: Replicate's seedream-3, returning PNG bytes."""
+    # Imported here so the cache can be exercised without the Replicate client installed
+    from generate_base_img import generate_base_image_replicate
+    return generate_base_image_replicate(prompt)
+
+def read_fresh(image_path, ttl):
+    """Cached bytes if the entry exists and is younger than ttl seconds, else None."""
+    try:
+        if time.time() - os.path.getmtime(image_path) > ttl:
+            return None
+        with open(image_path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def get_base_image(prompt, model=BASE_IMAGE_MODEL, generator=None, cache_dir=None, ttl=None, max_bytes=None):
+    """
+    Image bytes for prompt, from the cache when a fresh entry exists,
+    otherwise from generator(prompt), which must return the image bytes.
+    """
+    if generator is None:
+        generator = replicate_generator
+    if cache_dir is None:
+        cache_dir = PROMPT_IMAGE_CACHE_DIR
+    if ttl is None:
+        ttl = PROMPT_IMAGE_CACHE_TTL
+    if max_bytes is None:
+        max_bytes = PROMPT_IMAGE_CACHE_MAX_BYTES
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = prompt_cache_key(prompt, model)
+    image_path = os.path.join(cache_dir, f"{key}.png")
+    image = read_fresh(image_path, ttl)
+    if image is not None:
+        print(f"Base image cache hit for {key[:12]}")
+        return image
+
+    # Single flight: whoever holds the lock generates, everyone else re-checks after it
+    with open(os.path.join(cache_dir, f"{key}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            image = read_fresh(image_path, ttl)
+            if image is not None:
+                print(f"Base image generated by a concurrent request for {key[:12]}")
+                return image
+            image = generator(prompt)
+            write_file_atomic(image_path, image)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    evict_images(cache_dir, ttl, max_bytes)
+    return image
+
+def evict_images(cache_dir, ttl, max_bytes):
+    """Drop expired images, then the oldest ones until the cache fits in max_bytes."""
+    entries = []
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".png"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > ttl:
+            remove_entry(path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        remove_entry(path)
+        total -= size
+
+def remove_entry(image_path):
+    for path in (image_path, image_path[:-len(".png")] + ".lock"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
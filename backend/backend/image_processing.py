@@ -2,10 +2,28 @@ import cv2
 import numpy as np
 import os
 
-def load_and_threshold_image(image_path, debug_dir=None):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+def decode_image(data):
+    """Decode encoded image bytes (PNG, JPEG, ...) to a grayscale array."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
     if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
+        raise ValueError("Could not decode image data")
+    return img
+
+def load_and_threshold_image(image, debug_dir=None):
+    """image may be a file path, encoded image bytes or an already decoded array."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        img = decode_image(image)
+    elif isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            img = image
+        elif image.shape[2] == 4:
+            img = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+        else:
+            img = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        img = cv2.imread(str(image), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise FileNotFoundError(f"Image not found: {image}")
 
     _, binary = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
 
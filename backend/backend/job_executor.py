@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from job_store import get_job, update_job
+
+# Font jobs are CPU-heavy (fontforge, potrace, NumPy), so they run in a small
+# pool of worker processes instead of the API process. The pool is replaced
+# when a worker dies (segfault, OOM kill), and, to give back memory leaked by
+# native libraries, once it has run JOB_MAX_TASKS_PER_CHILD jobs per worker
+# and has no job left. Waiting for it to drain keeps the number of live jobs
+# at JOB_WORKERS; under constant load the swap waits for the next idle moment.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "8"))
+JOB_MAX_TASKS_PER_CHILD = int(os.environ.get("JOB_MAX_TASKS_PER_CHILD", "4"))
+
+class QueueFull(Exception):
+    """Raised when every worker is busy and the waiting queue is full."""
+
+_executor = None
+# Jobs submitted to the current pool, and those of them not finished yet
+_executor_jobs = 0
+_executor_inflight = 0
+_executor_lock = threading.Lock()
+# Running plus waiting jobs
+_slots = threading.BoundedSemaphore(JOB_WORKERS + JOB_QUEUE_SIZE)
+
+def _current_executor():
+    """The pool to submit to, created or recycled as needed. Call with _executor_lock held."""
+    global _executor, _executor_jobs, _executor_inflight
+    if _executor is not None and _executor_inflight == 0 and \
+            _executor_jobs >= JOB_MAX_TASKS_PER_CHILD * JOB_WORKERS:
+        # Drained after its share of jobs: recycle the workers
+        _executor.shutdown(wait=False)
+        _executor = None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _executor_jobs = 0
+        _executor_inflight = 0
+    return _executor
+
+def retire_executor(executor):
+    """
+    Stop handing new jobs to a broken executor; the next submit starts a
+    fresh pool. A broken pool has failed all its jobs, so none overlap.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+def _task_done(executor, future):
+    global _executor_inflight
+    _slots.release()
+    with _executor_lock:
+        if _executor is executor:
+            _executor_inflight -= 1
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        # A worker died; the pool accepts no more work
+        retire_executor(executor)
+
+def _job_done(job_id, executor, future):
+    _task_done(executor, future)
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is None:
+        return
+    print(f"Job {job_id} failed in worker: {error!r}")
+    # The pipeline records its own errors, so this is a crash it never saw
+    fields = {"status": "failed", "info_message": "Font generation failed", "error": f"Worker crashed: {error!r}"}
+    job = get_job(job_id)
+    if job is not None and job["regeneration_status"] == "in_progress":
+        fields["regeneration_status"] = "failed"
+    update_job(job_id, **fields)
+
+def _submit(fn, args):
+    """Hand fn(*args) to the pool; returns (executor, future). Raises QueueFull."""
+    global _executor, _executor_jobs, _executor_inflight
+    if not _slots.acquire(blocking=False):
+        raise QueueFull(f"{JOB_WORKERS} workers busy and {JOB_QUEUE_SIZE} jobs waiting")
+    try:
+        # Submitting and counting under one lock, so a recycle never overlaps a new job
+        with _executor_lock:
+            executor = _current_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                executor.shutdown(wait=False)
+                _executor = None
+                executor = _current_executor()
+                future = executor.submit(fn, *args)
+            _executor_jobs += 1
+            _executor_inflight += 1
+    except Exception:
+        _slots.release()
+        raise
+    return executor, future
+
+def submit_job(job_id, fn, *args):
+    """
+    Run fn(*args) for job_id in a worker process and return its future
+    straight away. fn must be a module-level function so it can be pickled.
+    The job is marked failed if fn raises or its worker dies.
+    Raises QueueFull when the queue has no room left.
+    """
+    executor, future = _submit(fn, args)
+    future.add_done_callback(partial(_job_done, job_id, executor))
+    return future
+
+def submit_task(fn, *args):
+    """
+    Like submit_job for work that is not a job of its own (e.g. building a
+    weight on download): it shares the workers and the queue, and errors
+    are left to whoever waits on the future.
+    """
+    executor, future = _submit(fn, args)
+    future.add_done_callback(partial(_task_done, executor))
+    return future
+
+def shutdown_executor():
+    """Stop accepting jobs and let running ones finish."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,128 @@
+import datetime
+import json
+import os
+import sqlite3
+
+# Job state lives in one SQLite file shared by the API process and the job
+# workers. WAL mode lets pollers read while a worker is writing. Every update
+# is also appended to an events table that /font-events streams from.
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.db")
+JOB_FIELDS = ("status", "info_message", "regeneration_status", "regeneration_time", "error")
+
+def connect():
+    connection = sqlite3.connect(JOB_DB_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+def init_store():
+    """Create the tables if they do not exist yet."""
+    with connect() as connection:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'processing',
+                info_message TEXT,
+                regeneration_status TEXT,
+                regeneration_time TEXT,
+                error TEXT,
+                updated_at TEXT
+            )""")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                on_demand INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (job_id, name)
+            )""")
+        # Stores created before on-demand variants existed
+        columns = [column["name"] for column in connection.execute("PRAGMA table_info(artifacts)")]
+        if "on_demand" not in columns:
+            connection.execute("ALTER TABLE artifacts ADD COLUMN on_demand INTEGER NOT NULL DEFAULT 0")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            )""")
+        connection.execute("CREATE INDEX IF NOT EXISTS events_job ON events (job_id, id)")
+    connection.close()
+
+def update_job(job_id, artifacts=(), on_demand=(), **fields):
+    """
+    Insert or update a job row, record produced artifacts (download format
+    names such as "400-woff2") and ones that are built on first download,
+    and append the change as an event, all in one transaction.
+    """
+    unknown = set(fields) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+    event = dict(fields, artifacts=list(artifacts))
+    if on_demand:
+        event["on_demand"] = list(on_demand)
+    fields["updated_at"] = str(datetime.datetime.now())
+    columns = ", ".join(fields)
+    placeholders = ", ".join("?" for _ in fields)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+    with connect() as connection:
+        connection.execute(
+            f"INSERT INTO jobs (job_id, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT(job_id) DO UPDATE SET {updates}",
+            [job_id, *fields.values()])
+        connection.executemany(
+            "INSERT INTO artifacts (job_id, name, on_demand) VALUES (?, ?, 1) "
+            "ON CONFLICT(job_id, name) DO UPDATE SET on_demand = 1",
+            [(job_id, name) for name in on_demand])
+        connection.executemany(
+            "INSERT INTO artifacts (job_id, name) VALUES (?, ?) "
+            "ON CONFLICT(job_id, name) DO UPDATE SET on_demand = 0",
+            [(job_id, name) for name in artifacts])
+        connection.execute("INSERT INTO events (job_id, data) VALUES (?, ?)", (job_id, json.dumps(event)))
+    connection.close()
+
+def get_job(job_id):
+    """
+    Job row as a dict with its artifacts in the order they were produced and
+    the ones still to be built on demand, or None.
+    """
+    with connect() as connection:
+        row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            job = None
+        else:
+            job = dict(row)
+            rows = connection.execute(
+                "SELECT name, on_demand FROM artifacts WHERE job_id = ? ORDER BY id", (job_id,)).fetchall()
+            job["artifacts"] = [artifact["name"] for artifact in rows if not artifact["on_demand"]]
+            job["on_demand"] = [artifact["name"] for artifact in rows if artifact["on_demand"]]
+    connection.close()
+    return job
+
+def list_jobs(status):
+    """Job rows (without artifacts) that currently have the given status."""
+    with connect() as connection:
+        jobs = [dict(row) for row in connection.execute("SELECT * FROM jobs WHERE status = ?", (status,))]
+    connection.close()
+    return jobs
+
+def delete_job(job_id):
+    """Forget a job whose files have been removed."""
+    with connect() as connection:
+        for table in ("events", "artifacts", "jobs"):
+            connection.execute(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+    connection.close()
+
+def get_events(job_id, after_id=0):
+    """Events of a job newer than after_id as [(event_id, data), ...]."""
+    with connect() as connection:
+        events = [(row["id"], json.loads(row["data"])) for row in connection.execute(
+            "SELECT id, data FROM events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, after_id))]
+    connection.close()
+    return events
+
+def job_progress(job_id):
+    """Callback for pipeline stages: progress(info_message, artifacts=(), on_demand=())."""
+    def progress(info_message, artifacts=(), on_demand=()):
+        update_job(job_id, artifacts=artifacts, on_demand=on_demand, info_message=info_message)
+    return progress
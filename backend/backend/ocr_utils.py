@@ -8,8 +8,12 @@ import shutil
 import cairosvg
 import numpy as np
 
-def filter_noise_glyphs(glyphs_dir, min_size_ratio=0.25):
-    """Filter out noise glyphs that are significantly smaller than the average glyph."""
+def filter_noise_glyphs(glyphs_dir, min_size_ratio=0.25, path_bboxes=None):
+    """
+    Filter out noise glyphs that are significantly smaller than the average glyph.
+    path_bboxes, if given, holds the (x_min, x_max, y_min, y_max) bbox of every
+    glyph_<i>.svg by i, so the files do not have to be parsed for it.
+    """
     # Get list of all SVG files
     svg_files = sorted(f for f in os.listdir(glyphs_dir) if f.endswith('.svg'))
     
@@ -30,6 +34,11 @@ def filter_noise_glyphs(glyphs_dir, min_size_ratio=0.25):
             except ValueError:
                 continue
         
+        if path_bboxes is not None:
+            x_min, x_max, y_min, y_max = path_bboxes[idx]
+            glyph_sizes[idx] = (x_max - x_min) * (y_max - y_min)
+            continue
+
         svg_path = os.path.join(glyphs_dir, svg_filename)
         
         # Parse SVG
@@ -72,8 +81,20 @@ def filter_noise_glyphs(glyphs_dir, min_size_ratio=0.25):
     
     return keep_glyphs, noise_glyphs
 
-def extract_chars(glyphs_dir, api_key=None):
-    """Extract characters from glyphs using a vision model."""
+def load_glyph_mapping(output_dir):
+    """The {new_index: original_index} map written by extract_chars, empty if there is none."""
+    mapping_path = os.path.join(output_dir, "glyph_mapping.txt")
+    if not os.path.exists(mapping_path):
+        return {}
+    with open(mapping_path) as f:
+        next(f)
+        return {int(new_idx): int(orig_idx) for new_idx, orig_idx in (line.split() for line in f if line.strip())}
+
+def extract_chars(glyphs_dir, api_key=None, path_bboxes=None):
+    """
+    Extract characters from glyphs using a vision model. path_bboxes, if
+    given, are the glyph bboxes by index, as for filter_noise_glyphs.
+    """
     # Get API key from environment variable if not provided
     if not api_key:
         api_key = os.environ.get("OPENROUTER_API_KEY")
@@ -101,7 +122,7 @@ def extract_chars(glyphs_dir, api_key=None):
     os.makedirs(output_dir, exist_ok=True)
     
     # Filter out noise glyphs
-    keep_glyphs, noise_glyphs = filter_noise_glyphs(glyphs_dir)
+    keep_glyphs, noise_glyphs = filter_noise_glyphs(glyphs_dir, path_bboxes=path_bboxes)
     if not keep_glyphs:
         print("No valid glyphs found after filtering")
         return {}
@@ -134,6 +155,10 @@ def extract_chars(glyphs_dir, api_key=None):
         svg_path = os.path.join(filtered_dir, f"glyph_{new_idx}.svg")
         if not os.path.exists(svg_path):
             continue
+        if path_bboxes is not None:
+            x_min, x_max, y_min, y_max = path_bboxes[orig_idx]
+            glyph_bboxes[new_idx] = (x_min, y_min, x_max, y_max)
+            continue
             
         try:
             tree = ET.parse(svg_path)
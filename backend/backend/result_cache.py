@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Completed pipeline outputs keyed by the SHA-256 of the uploaded image.
+# Entries hold hardlinks to a job's output files, so storing and reusing a
+# result costs no copies. Least recently used entries are evicted first.
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "cache/results")
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "100"))
+# Bump when a pipeline change makes older results wrong
+RESULT_CACHE_VERSION = 1
+META_NAME = "meta.json"
+# Scratch space of the regeneration flows, never part of a result
+SKIPPED_DIRS = {"temp_glyphs"}
+# Per-job files that sharing would couple across jobs: lock files of the lazy
+# weight builds, and the retention access stamp (touching one would refresh
+# the LRU position of every job linked to the same entry)
+SKIPPED_SUFFIXES = (".lock", ".last_access")
+
+def cache_key(image_digest, output_mode):
+    return f"v{RESULT_CACHE_VERSION}-{output_mode}-{image_digest}"
+
+def link_tree(src_dir, dst_dir, skip_dirs=()):
+    """Recreate src_dir under dst_dir with hardlinks, copying where linking is not possible."""
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = [d for d in dirs if d not in skip_dirs]
+        target_root = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            if name.endswith(SKIPPED_SUFFIXES):
+                continue
+            src, dst = os.path.join(root, name), os.path.join(target_root, name)
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+def unshare_tree(directory):
+    """
+    Give every hardlinked file under directory its own copy. Must run before
+    anything rewrites a job's files in place (fontforge, zipfile), or the
+    change would leak into the cache and into other jobs.
+    """
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.stat(path).st_nlink > 1:
+                tmp_path = path + ".unshare"
+                shutil.copy2(path, tmp_path)
+                os.replace(tmp_path, path)
+
+def lookup(key):
+    """Metadata of a cached result, or None. A hit counts as a use for LRU."""
+    entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+    meta_path = os.path.join(entry_dir, META_NAME)
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        os.utime(meta_path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta
+
+def materialize(key, output_dir):
+    """Link a cached result into a job's output directory. Returns False if the entry vanished meanwhile."""
+    entry_output = os.path.join(RESULT_CACHE_DIR, key, "output")
+    try:
+        link_tree(entry_output, output_dir)
+    except FileNotFoundError:
+        # Evicted while we were linking; the caller computes the job instead
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+        return False
+    return True
+
+def store_result(key, output_dir, artifacts, on_demand=()):
+    """Publish a finished job's output under key; the first writer wins."""
+    entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+    if os.path.exists(entry_dir):
+        return
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    tmp_dir = os.path.join(RESULT_CACHE_DIR, f".tmp-{uuid.uuid4().hex}")
+    try:
+        link_tree(output_dir, os.path.join(tmp_dir, "output"), skip_dirs=SKIPPED_DIRS)
+        with open(os.path.join(tmp_dir, META_NAME), "w") as f:
+            json.dump({"artifacts": artifacts, "on_demand": list(on_demand), "created_at": time.time()}, f)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another job published the same key first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    evict()
+
+def evict(max_entries=None):
+    """Remove least recently used entries beyond max_entries."""
+    if max_entries is None:
+        max_entries = RESULT_CACHE_MAX_ENTRIES
+    entries = []
+    for key in os.listdir(RESULT_CACHE_DIR):
+        meta_path = os.path.join(RESULT_CACHE_DIR, key, META_NAME)
+        if key.startswith(".tmp-"):
+            continue
+        try:
+            entries.append((os.path.getmtime(meta_path), key))
+        except FileNotFoundError:
+            continue
+    entries.sort()
+    for _, key in entries[:max(0, len(entries) - max_entries)]:
+        shutil.rmtree(os.path.join(RESULT_CACHE_DIR, key), ignore_errors=True)
@@ -0,0 +1,265 @@
+import os
+import shutil
+import threading
+import time
+from job_store import get_job, delete_job
+from result_cache import RESULT_CACHE_DIR, META_NAME
+from image_cache import PROMPT_IMAGE_CACHE_DIR, remove_entry as remove_image_entry
+
+# Jobs leave uploads/, output/ and debug/ trees behind. This removes them in
+# three classes, cheapest to lose first: debug output, then intermediates
+# (per-glyph SVGs, checkpoints), then whole jobs. Each class has a TTL
+# measured from the job's last access. When the job trees and the caches
+# together exceed the disk quota, the least recently used jobs lose data in
+# the same order, with cache entries going before whole jobs.
+RETENTION_DEBUG_TTL = int(os.environ.get("RETENTION_DEBUG_TTL", str(24 * 3600)))
+RETENTION_INTERMEDIATE_TTL = int(os.environ.get("RETENTION_INTERMEDIATE_TTL", str(3 * 24 * 3600)))
+RETENTION_JOB_TTL = int(os.environ.get("RETENTION_JOB_TTL", str(30 * 24 * 3600)))
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", str(20 * 1024 ** 3)))
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "600"))
+
+JOB_ROOTS = ("uploads", "output", "debug")
+# Relative to output/<job_id>; none of these are needed by a finished job
+INTERMEDIATE_PATHS = ("glyphs", "filtered_glyphs", "temp_glyphs", "checkpoints", "font.svg")
+LAST_ACCESS_NAME = ".last_access"
+
+def touch_job(job_id):
+    """Record an access (e.g. a download) for LRU ordering."""
+    output_dir = os.path.join("output", job_id)
+    if not os.path.isdir(output_dir):
+        return
+    stamp_path = os.path.join(output_dir, LAST_ACCESS_NAME)
+    # Stamps linked in from the result cache by older versions are shared with other jobs
+    if os.path.exists(stamp_path) and os.stat(stamp_path).st_nlink > 1:
+        os.remove(stamp_path)
+    with open(stamp_path, "a"):
+        pass
+    os.utime(stamp_path)
+
+def last_access(job_id):
+    for path in (os.path.join("output", job_id, LAST_ACCESS_NAME), os.path.join("output", job_id),
+                 os.path.join("uploads", job_id), os.path.join("debug", job_id)):
+        try:
+            return os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+    return 0
+
+def list_job_ids():
+    job_ids = set()
+    for root in JOB_ROOTS:
+        if os.path.isdir(root):
+            job_ids.update(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    return job_ids
+
+def owner_of(path):
+    """
+    What removes the file at path: ("debug" | "intermediates" | "jobs", job_id)
+    for job trees, ("cache", entry path) for cache entries, None otherwise.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    if parts[0] in JOB_ROOTS and len(parts) > 2:
+        if parts[0] == "debug":
+            return ("debug", parts[1])
+        if parts[0] == "output" and parts[2] in INTERMEDIATE_PATHS:
+            return ("intermediates", parts[1])
+        return ("jobs", parts[1])
+    for cache_dir in (RESULT_CACHE_DIR, PROMPT_IMAGE_CACHE_DIR):
+        prefix = os.path.normpath(cache_dir).split(os.sep)
+        if parts[:len(prefix)] == prefix and len(parts) > len(prefix):
+            name = parts[len(prefix)]
+            # Entries being published and the image lock files are never evicted
+            if cache_dir == RESULT_CACHE_DIR and not name.startswith(".tmp-"):
+                return ("cache", os.path.join(cache_dir, name))
+            if cache_dir == PROMPT_IMAGE_CACHE_DIR and name.endswith(".png"):
+                return ("cache", os.path.join(cache_dir, name))
+            return None
+    return None
+
+def index_usage():
+    """
+    Walk the job trees and caches once. Returns (usage, links, owned): the
+    bytes used, counting hardlinked files once; {inode: [bytes, links left]};
+    and {owner: {inode: links}} for the owners of owner_of.
+    """
+    usage = 0
+    links = {}
+    owned = {}
+    roots = [root for root in JOB_ROOTS + (RESULT_CACHE_DIR, PROMPT_IMAGE_CACHE_DIR) if os.path.isdir(root)]
+    for root_dir in roots:
+        for root, _, files in os.walk(root_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.lstat(path)
+                except FileNotFoundError:
+                    continue
+                inode = (stat.st_dev, stat.st_ino)
+                if inode not in links:
+                    # Links outside these trees (if any) keep the file alive, so start from st_nlink
+                    links[inode] = [stat.st_blocks * 512, stat.st_nlink]
+                    usage += stat.st_blocks * 512
+                owner = owner_of(path)
+                if owner is not None:
+                    owner_links = owned.setdefault(owner, {})
+                    owner_links[inode] = owner_links.get(inode, 0) + 1
+    return usage, links, owned
+
+def release(owner, links, owned):
+    """Drop the links of a removed owner from the index. Returns the bytes that freed."""
+    freed = 0
+    for inode, count in owned.pop(owner, {}).items():
+        links[inode][1] -= count
+        if links[inode][1] <= 0:
+            freed += links[inode][0]
+    return freed
+
+def shared(owner, links, owned):
+    """True if some file of owner is also linked from somewhere else."""
+    return any(links[inode][1] > count for inode, count in owned.get(owner, {}).items())
+
+def debug_paths(job_id):
+    return [os.path.join("debug", job_id)]
+
+def intermediate_paths(job_id):
+    return [os.path.join("output", job_id, name) for name in INTERMEDIATE_PATHS]
+
+def job_paths(job_id):
+    return [os.path.join(root, job_id) for root in JOB_ROOTS]
+
+def remove_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+CLASS_PATHS = {"debug": debug_paths, "intermediates": intermediate_paths, "jobs": job_paths}
+
+def evict(job_id, artifact_class):
+    """Remove one class of a job's data. Returns False if there was nothing to remove."""
+    paths = [path for path in CLASS_PATHS[artifact_class](job_id) if os.path.exists(path)]
+    if not paths:
+        return False
+    remove_paths(paths)
+    if artifact_class == "jobs":
+        delete_job(job_id)
+    print(f"Retention: removed {artifact_class} of job {job_id}")
+    return True
+
+def cache_entries():
+    """Result cache entries and cached prompt images as (last use, path), least recently used first."""
+    entries = []
+    if os.path.isdir(RESULT_CACHE_DIR):
+        for key in os.listdir(RESULT_CACHE_DIR):
+            if key.startswith(".tmp-"):
+                continue
+            entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+            try:
+                entries.append((os.path.getmtime(os.path.join(entry_dir, META_NAME)), entry_dir))
+            except FileNotFoundError:
+                continue
+    if os.path.isdir(PROMPT_IMAGE_CACHE_DIR):
+        for name in os.listdir(PROMPT_IMAGE_CACHE_DIR):
+            if not name.endswith(".png"):
+                continue
+            image_path = os.path.join(PROMPT_IMAGE_CACHE_DIR, name)
+            try:
+                entries.append((os.path.getmtime(image_path), image_path))
+            except FileNotFoundError:
+                continue
+    return sorted(entries)
+
+def evict_cache_entry(path, links, owned):
+    """
+    Remove a cache entry unless some of its files are still linked from a
+    job; that job's removal frees them. Returns the bytes freed, or None if
+    the entry was kept.
+    """
+    owner = ("cache", path)
+    if shared(owner, links, owned):
+        return None
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        remove_image_entry(path)
+    freed = release(owner, links, owned)
+    print(f"Retention: removed cache entry {path} ({freed} bytes freed)")
+    return freed
+
+def trim_caches(usage, max_bytes, cache_paths, links, owned):
+    """
+    Remove unshared entries of cache_paths (least recently used first, and
+    dropped from the list once removed) until usage fits. Returns the new usage.
+    """
+    for path in list(cache_paths):
+        if usage <= max_bytes:
+            break
+        freed = evict_cache_entry(path, links, owned)
+        if freed is not None:
+            cache_paths.remove(path)
+            usage -= freed
+    return usage
+
+def run_retention(now=None, max_bytes=None):
+    """One pass: apply the TTLs, then evict least recently used data until under the quota."""
+    if now is None:
+        now = time.time()
+    if max_bytes is None:
+        max_bytes = RETENTION_MAX_BYTES
+
+    # Running jobs are never touched
+    idle_jobs = []
+    for job_id in list_job_ids():
+        job = get_job(job_id)
+        if job is None or job["status"] != "processing":
+            idle_jobs.append((last_access(job_id), job_id))
+    idle_jobs.sort()
+
+    remaining = []
+    for accessed, job_id in idle_jobs:
+        age = now - accessed
+        if age > RETENTION_JOB_TTL:
+            evict(job_id, "jobs")
+            continue
+        if age > RETENTION_INTERMEDIATE_TTL:
+            evict(job_id, "intermediates")
+        if age > RETENTION_DEBUG_TTL:
+            evict(job_id, "debug")
+        remaining.append(job_id)
+
+    # Sizes are taken in one walk; hardlinks between jobs and the result
+    # cache mean a file only frees its bytes once its last link is removed.
+    usage, links, owned = index_usage()
+    for artifact_class in ("debug", "intermediates"):
+        for job_id in remaining:
+            if usage <= max_bytes:
+                return
+            if evict(job_id, artifact_class):
+                usage -= release((artifact_class, job_id), links, owned)
+    cache_paths = [path for _, path in cache_entries()]
+    usage = trim_caches(usage, max_bytes, cache_paths, links, owned)
+    for job_id in remaining:
+        if usage <= max_bytes:
+            return
+        if evict(job_id, "jobs"):
+            for artifact_class in CLASS_PATHS:
+                usage -= release((artifact_class, job_id), links, owned)
+            # The job's files stay on disk while a cache entry links them; that entry goes too
+            usage = trim_caches(usage, max_bytes, cache_paths, links, owned)
+
+def retention_loop(interval):
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"Retention pass failed: {e}")
+        time.sleep(interval)
+
+def start_retention_thread(interval=None):
+    """Run retention passes in a daemon thread so requests never wait on them."""
+    if interval is None:
+        interval = RETENTION_INTERVAL
+    thread = threading.Thread(target=retention_loop, args=(interval,), name="retention", daemon=True)
+    thread.start()
+    return thread
@@ -1,39 +1,72 @@
 import potrace
-from utils import get_path_bbox, filter_large_bboxes
-from glyph_segmentation import merge_glyph_paths
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from glyph_segmentation import segment_bitmap
+from glyph_outline import GlyphOutline
 import os
 
-def trace_bitmap_to_svg_paths(bitmap, debug_dir=None):
-    bmp = potrace.Bitmap(bitmap)
-    path = bmp.trace()
+# Processes tracing glyphs in parallel; 1 traces in-process
+TRACE_WORKERS = int(os.environ.get("TRACE_WORKERS", "1"))
 
-    # Add paths to SVG
-    paths_data = []
-    for curve in path:
-        path_d = f'M{curve.start_point[0]},{curve.start_point[1]} '
-        for segment in curve:
-            if segment.is_corner:
-                c_x, c_y = segment.c
-                end_x, end_y = segment.end_point
-                path_d += f"L{c_x},{c_y} L{end_x},{end_y} "
-            else:
-                c1_x, c1_y = segment.c1
-                c2_x, c2_y = segment.c2
-                end_x, end_y = segment.end_point
-                path_d += f"C{c1_x},{c1_y} {c2_x},{c2_y} {end_x},{end_y} "
-        path_d += 'Z'
-        paths_data.append(path_d)
+def trace_glyph(labels, group, bbox):
+    """Trace the components of one glyph, cropped to its bbox, into sheet coordinates."""
+    x_min, x_max, y_min, y_max = (int(value) for value in bbox)
+    # Only this glyph's ink: neighbours reaching into the bbox are left out
+    mask = np.isin(labels[y_min:y_max, x_min:x_max], group).astype(np.uint8)
+    return GlyphOutline.from_potrace(potrace.Bitmap(mask).trace(), x_min, y_min)
 
-    bboxes = [get_path_bbox(path_d) for path_d in paths_data]
-    filtered_bboxes = filter_large_bboxes(bboxes)
+def trace_shared_glyph(shm_name, shape, dtype, group, bbox):
+    """trace_glyph on a label image held in shared memory, for worker processes."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        labels = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        outline = trace_glyph(labels, group, bbox)
+        del labels
+        return outline
+    finally:
+        shm.close()
 
-    merged_paths, merged_bboxes = merge_glyph_paths(paths_data, filtered_bboxes, debug_dir=debug_dir, debug=True)
+def trace_glyphs_parallel(labels, groups, bboxes, workers):
+    """
+    Trace glyphs across a process pool. The label image is placed in shared
+    memory once; each task only carries a glyph's labels and bbox and reads
+    its crop from there. Outlines come back in the order of groups.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=labels.nbytes)
+    try:
+        shared_labels = np.ndarray(labels.shape, dtype=labels.dtype, buffer=shm.buf)
+        shared_labels[:] = labels
+        chunksize = max(1, len(groups) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            paths = list(pool.map(trace_shared_glyph, repeat(shm.name), repeat(labels.shape), repeat(labels.dtype.str),
+                                  groups, bboxes, chunksize=chunksize))
+        del shared_labels
+    finally:
+        shm.close()
+        shm.unlink()
+    return paths
+
+def trace_bitmap_to_svg_paths(bitmap, debug_dir=None, workers=None):
+    """
+    Segment the sheet into glyphs on the raster, then trace each glyph on its
+    own, over `workers` processes (default: TRACE_WORKERS). Returns one
+    GlyphOutline per glyph and its bbox, in reading order.
+    """
+    if workers is None:
+        workers = TRACE_WORKERS
+    labels, groups, merged_bboxes = segment_bitmap(bitmap, debug_dir=debug_dir, debug=True)
+    if workers > 1 and len(groups) > 1:
+        merged_paths = trace_glyphs_parallel(labels, groups, merged_bboxes, min(workers, len(groups)))
+    else:
+        merged_paths = [trace_glyph(labels, group, bbox) for group, bbox in zip(groups, merged_bboxes)]
 
     if debug_dir:
         # Save raw SVG for debugging
         svg_content = '<svg xmlns="http://www.w3.org/2000/svg">\n'
-        for path_d in merged_paths:
-            svg_content += f'<path d="{path_d}" fill="black" fill-rule="evenodd" />\n'
+        for outline in merged_paths:
+            svg_content += f'<path d="{outline.to_svg_path()}" fill="black" fill-rule="evenodd" />\n'
         svg_content += '</svg>'
         with open(os.path.join(debug_dir, "traced.svg"), "w") as f:
             f.write(svg_content)
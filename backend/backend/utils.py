@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 from svgpathtools import parse_path
 
 def get_path_bbox(path_d, transform=None):
@@ -46,3 +49,23 @@ def filter_large_bboxes(bboxes, max_width=2000, max_height=2000):
         if width < max_width and height < max_height:
             filtered.append(bbox)
     return filtered
+
+def write_file_atomic(path, data):
+    """
+    Write str or bytes to a temp file next to path and rename it over path,
+    so readers never see a partial file.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json_atomic(path, data):
+    """Write JSON atomically, see write_file_atomic."""
+    write_file_atomic(path, json.dumps(data))
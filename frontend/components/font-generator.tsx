@@ -11,7 +11,7 @@ import { Label } from "@/components/ui/label"
 import { Textarea } from "@/components/ui/textarea"
 import { useToast } from "@/hooks/use-toast"
 import FontCustomizer from "@/components/font-customizer"
-import { uploadFontImage, checkFontStatus, getFontDownloadUrl, generateFontFromPrompt } from "@/lib/api"
+import { uploadFontImage, checkFontStatus, getFontDownloadUrl, generateFontFromPrompt, subscribeFontEvents } from "@/lib/api"
 import { Progress } from "@/components/ui/progress"
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert"
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs"
@@ -333,8 +333,15 @@ export default function FontGenerator({ droppedFile }: FontGeneratorProps) {
   useEffect(() => {
     if (!jobId || !isProcessing) return
 
-    const interval = setInterval(checkStatus, 2000)
-    return () => clearInterval(interval)
+    // Re-check the status whenever the backend reports progress; poll only if the event stream is unavailable
+    let interval: ReturnType<typeof setInterval> | null = null
+    const unsubscribe = subscribeFontEvents(jobId, checkStatus, () => {
+      if (!interval) interval = setInterval(checkStatus, 2000)
+    })
+    return () => {
+      unsubscribe()
+      if (interval) clearInterval(interval)
+    }
   }, [jobId, isProcessing])
 
   // Add this function after the other useEffect hooks
@@ -140,6 +140,36 @@ export async function checkFontStatus(jobId: string): Promise<{
   }
 }
 
+/**
+ * Subscribes to the server-sent progress events of a job
+ * @param jobId The job to follow
+ * @param onEvent Called with each event payload (status, info-message, new_formats)
+ * @param onError Called once if the stream cannot be opened or drops, so the caller can fall back to polling
+ * @returns Function that closes the stream
+ */
+export function subscribeFontEvents(
+  jobId: string,
+  onEvent: (event: { status?: string; "info-message"?: string; new_formats?: string[] }) => void,
+  onError?: () => void,
+): () => void {
+  if (!jobId || typeof EventSource === "undefined") {
+    onError?.()
+    return () => {}
+  }
+
+  const source = new EventSource(`${API_BASE_URL}/font-events/${jobId}`)
+  source.addEventListener("progress", (event) => {
+    onEvent(JSON.parse((event as MessageEvent).data))
+  })
+  // The backend closes the stream once the job is completed or failed
+  source.addEventListener("end", () => source.close())
+  source.onerror = () => {
+    source.close()
+    onError?.()
+  }
+  return () => source.close()
+}
+
 // The rest of the file remains the same
 export function getFontDownloadUrl(jobId: string, format: string): string {
   // Make sure the format is one of the allowed values